@@ -1,19 +1,54 @@
-from dotenv import load_dotenv
 import os
 import re
+import json
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.memory import MemorySaver
-from langchain_google_genai import ChatGoogleGenerativeAI
 from pypdf import PdfReader
+import pandas as pd
+from cache import cache_path, file_digest, is_fresh, schema_tag, write_atomic
+from gemini import aanalyze, analyze
 
-load_dotenv()
+try:
+    import pypdfium2 as pdfium  # Native PDFium text extraction, much faster than pypdf
+except ImportError:
+    pdfium = None
+
+# Part of the PDF text cache key: PDFium and pypdf lay text out differently, and the
+# number is bumped when extraction changes (3: entries hold the figures and a partial flag)
+PDF_TEXT_SCHEMA = schema_tag(3, "pdfium" if pdfium is not None else "pypdf")
 
 # Check if API key is available
 if not os.getenv("GOOGLE_API_KEY"):
     print("⚠️  Warning: GOOGLE_API_KEY not found in environment variables")
     print("Please set your Google API key in a .env file or environment variable")
 
+# --- Metric patterns ---
+# Each pattern captures its figure in a single group. They are fused into one
+# alternation (compiled once at import) so the extracted text is scanned once.
+METRIC_PATTERNS = {
+    "Total Revenue": r"Total Revenue\s+([\d,]+\.\d+)",
+    "Total Cost of Sales": r"Total Cost of sales\s+\(([\d,]+\.\d+)\)",
+    "Profit Before Tax": r"Profit Before Tax\s+([\d,]+\.\d+)",
+    "Total Expenses": r"Total Expenses\s+\(([\d,]+\.\d+)\)",
+    "Net Profit": r"Net Profit/\(Loss\)\s+([\d,]+\.\d+)",
+    "Income Tax Expenses": r"Income Tax Expenses\s+([\d,]+\.\d+)",
+    "Profit For the Year": r"Profit For the Year\s+([\d,]+\.\d+)"
+}
+METRIC_REGEX = re.compile(
+    "|".join(f"(?P<m{i}>{pattern})" for i, pattern in enumerate(METRIC_PATTERNS.values())),
+    re.IGNORECASE
+)
+METRIC_GROUPS = {f"m{i}": key for i, key in enumerate(METRIC_PATTERNS)}
+
+# Upper bound on threads used to extract text from a multi-page PDF
+PDF_EXTRACT_WORKERS = min(8, os.cpu_count() or 1)
+
+# Pages with a content stream this large and no fonts are drawings/scans, not text
+GRAPHICS_PAGE_BYTES = 1 << 20
+
 # --- Define State ---
 class StatementState(TypedDict):
     file_path: str
@@ -23,18 +58,138 @@ class StatementState(TypedDict):
     analysis: str
 
 # --- Step 1: Read and extract totals from PDF ---
-def read_statement(state: StatementState) -> StatementState:
+def _is_graphics_page(page) -> bool:
+    """Cheap check for pages with a huge content stream but no fonts to draw text with"""
+    resources = page.get("/Resources")
+    if resources is not None and "/Font" in resources.get_object():
+        return False
+    contents = page.get_contents()
+    return contents is not None and len(contents.get_data()) > GRAPHICS_PAGE_BYTES
+
+def _iter_pages_threaded(file_path: str, page_count: int, start: int = 0):
+    """Yield page texts in order, from page index start, while worker threads extract the pages ahead"""
+    # PdfReader shares one file handle between pages, so each thread gets its own
+    local = threading.local()
+
+    def extract(index: int) -> str:
+        reader = getattr(local, "reader", None)
+        if reader is None:
+            reader = local.reader = PdfReader(file_path)
+        try:
+            page = reader.pages[index]
+            if _is_graphics_page(page):
+                return ""
+            return page.extract_text() or ""
+        except Exception as e:
+            print(f"⚠️  Warning: Could not extract text from page {index + 1}: {e}")
+            return ""
+
+    executor = ThreadPoolExecutor(max_workers=min(PDF_EXTRACT_WORKERS, page_count - start))
     try:
-        reader = PdfReader(state["file_path"])
-        text = ""
-        for page in reader.pages:
-            try:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-            except Exception as e:
-                print(f"⚠️  Warning: Could not extract text from page: {e}")
+        futures = [executor.submit(extract, index) for index in range(start, page_count)]
+        for future in futures:
+            page_text = future.result()
+            if page_text:
+                yield page_text
+    finally:
+        # Pages still queued when the caller stops early are never extracted
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def _iter_pages_pypdf(file_path: str, start: int = 0):
+    """Yield page texts with pypdf from page index start, using worker threads for multi-page files"""
+    reader = PdfReader(file_path)
+    page_count = len(reader.pages)
+    if page_count - start > 1 and PDF_EXTRACT_WORKERS > 1:
+        yield from _iter_pages_threaded(file_path, page_count, start)
+        return
+
+    for index in range(start, page_count):
+        try:
+            page = reader.pages[index]
+            if _is_graphics_page(page):
                 continue
+            page_text = page.extract_text()
+            if page_text:
+                yield page_text
+        except Exception as e:
+            print(f"⚠️  Warning: Could not extract text from page: {e}")
+            continue
+
+def _iter_pages_pdfium(pdf):
+    """Yield (page index, text) with PDFium (not thread-safe, so pages are read serially)"""
+    try:
+        for index, page in enumerate(pdf):
+            yield index, page.get_textpage().get_text_range().replace("\r\n", "\n")
+    finally:
+        pdf.close()
+
+def _iter_page_texts(file_path: str):
+    """Yield the text of each page, preferring PDFium over pypdf
+
+    If PDFium cannot open the file or fails partway through, pypdf reads the
+    pages from the failing one on.
+    """
+    start = 0
+    if pdfium is not None:
+        pages = None
+        try:
+            pages = _iter_pages_pdfium(pdfium.PdfDocument(file_path))
+            for index, page_text in pages:
+                start = index + 1
+                if page_text:
+                    yield page_text
+            return
+        except Exception as e:
+            print(f"⚠️  Warning: PDFium failed at page {start + 1}, falling back to pypdf: {e}")
+        finally:
+            if pages is not None:
+                pages.close()
+    yield from _iter_pages_pypdf(file_path, start)
+
+def _find_metrics(text: str, raw_values: dict):
+    """Record the first raw figure of each metric that appears in text"""
+    for match in METRIC_REGEX.finditer(text):
+        key = METRIC_GROUPS[match.lastgroup]
+        if key not in raw_values:  # Keep the first occurrence of each metric
+            # The figure is the group nested directly inside the named one
+            raw_values[key] = match.group(match.lastindex + 1)
+
+def read_statement(state: StatementState) -> StatementState:
+    try:
+        # Extract key totals from your PDF
+        raw_values = {}
+
+        # Re-runs on the same file skip parsing by reusing the cached text and figures
+        text_cache = cache_path("pdf_text", f"{file_digest(state['file_path'])}-{PDF_TEXT_SCHEMA}", ".json")
+        if is_fresh(text_cache):
+            entry = json.loads(text_cache.read_bytes())
+            text = entry["text"]
+            raw_values = entry["raw_values"]
+            print(f"✅ Loaded extracted text from cache{' (pages up to the last metric)' if entry['partial'] else ''}")
+        else:
+            # Scan each page as it is extracted and stop reading once every metric is found
+            page_texts = []
+            partial = False
+            pages = _iter_page_texts(state["file_path"])
+            for page_text in pages:
+                page_texts.append(page_text)
+                _find_metrics(page_text, raw_values)
+                if len(raw_values) == len(METRIC_PATTERNS):
+                    pages.close()
+                    partial = True
+                    break
+
+            # Join once instead of growing the string page by page
+            text = "\n".join(page_texts)
+            if len(raw_values) < len(METRIC_PATTERNS):
+                # A figure may sit across a page break, which only the joined text shows
+                _find_metrics(text, raw_values)
+
+            # Cache exactly what this read produced: after an early stop that is the pages up
+            # to the last metric, which is all a re-run needs, flagged as partial
+            if text.strip():
+                entry = {"text": text, "raw_values": raw_values, "partial": partial}
+                write_atomic(text_cache, json.dumps(entry).encode("utf-8"))
         
         if not text.strip():
             raise ValueError("No text could be extracted from the PDF")
@@ -42,28 +197,22 @@ def read_statement(state: StatementState) -> StatementState:
         state["text"] = text
         print(f"✅ Successfully extracted {len(text)} characters from PDF")
 
-        # Extract key totals from your PDF
+        # Convert every figure in one vectorized pass; unparseable ones become NaN
+        values = pd.to_numeric(
+            pd.Series(list(raw_values.values()), dtype="string").str.replace(",", "", regex=False),
+            errors="coerce"
+        ).astype("float64").tolist()
+
         metrics = {}
-        patterns = {
-            "Total Revenue": r"Total Revenue\s+([\d,]+\.\d+)",
-            "Total Cost of Sales": r"Total Cost of sales\s+\(([\d,]+\.\d+)\)",
-            "Profit Before Tax": r"Profit Before Tax\s+([\d,]+\.\d+)",
-            "Total Expenses": r"Total Expenses\s+\(([\d,]+\.\d+)\)",
-            "Net Profit": r"Net Profit/\(Loss\)\s+([\d,]+\.\d+)",
-            "Income Tax Expenses": r"Income Tax Expenses\s+([\d,]+\.\d+)",
-            "Profit For the Year": r"Profit For the Year\s+([\d,]+\.\d+)"
-        }
-
-        for key, pattern in patterns.items():
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                try:
-                    value = float(match.group(1).replace(",", ""))
-                    metrics[key] = value
-                    print(f"✅ Found {key}: {value}")
-                except ValueError:
-                    print(f"⚠️  Could not parse value for {key}: {match.group(1)}")
-            else:
+        for (key, raw_value), value in zip(raw_values.items(), values):
+            if math.isnan(value):
+                print(f"⚠️  Could not parse value for {key}: {raw_value}")
+                continue
+            metrics[key] = value
+            print(f"✅ Found {key}: {value}")
+
+        for key in METRIC_PATTERNS:
+            if key not in metrics:
                 print(f"⚠️  Could not find {key}")
 
         state["metrics"] = metrics
@@ -83,35 +232,35 @@ def calculate_ratios(state: StatementState) -> StatementState:
     print(f"\n📊 Calculating ratios from {len(m)} metrics...")
 
     if "Total Revenue" in m and "Total Cost of Sales" in m:
-        try:
+        if m["Total Revenue"]:
             gross_margin = ((m['Total Revenue'] - m['Total Cost of Sales']) / m['Total Revenue']) * 100
             ratios["Gross Margin"] = f"{round(gross_margin, 2)}%"
             print(f"✅ Calculated Gross Margin: {ratios['Gross Margin']}")
-        except ZeroDivisionError:
+        else:
             print("⚠️  Cannot calculate Gross Margin: Total Revenue is zero")
 
     if "Net Profit" in m and "Total Revenue" in m:
-        try:
+        if m["Total Revenue"]:
             net_margin = (m['Net Profit'] / m['Total Revenue']) * 100
             ratios["Net Profit Margin"] = f"{round(net_margin, 2)}%"
             print(f"✅ Calculated Net Profit Margin: {ratios['Net Profit Margin']}")
-        except ZeroDivisionError:
+        else:
             print("⚠️  Cannot calculate Net Profit Margin: Total Revenue is zero")
 
     if "Profit Before Tax" in m and "Total Revenue" in m:
-        try:
+        if m["Total Revenue"]:
             pbt_margin = (m['Profit Before Tax'] / m['Total Revenue']) * 100
             ratios["PBT Margin"] = f"{round(pbt_margin, 2)}%"
             print(f"✅ Calculated PBT Margin: {ratios['PBT Margin']}")
-        except ZeroDivisionError:
+        else:
             print("⚠️  Cannot calculate PBT Margin: Total Revenue is zero")
 
     if "Total Expenses" in m and "Total Revenue" in m:
-        try:
+        if m["Total Revenue"]:
             expense_ratio = (m['Total Expenses'] / m['Total Revenue']) * 100
             ratios["Expense Ratio"] = f"{round(expense_ratio, 2)}%"
             print(f"✅ Calculated Expense Ratio: {ratios['Expense Ratio']}")
-        except ZeroDivisionError:
+        else:
             print("⚠️  Cannot calculate Expense Ratio: Total Revenue is zero")
 
     state["ratios"] = ratios
@@ -119,22 +268,8 @@ def calculate_ratios(state: StatementState) -> StatementState:
     return state
 
 # --- Step 3: Analyze with Gemini ---
-def analyze_statement(state: StatementState) -> StatementState:
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        print("❌ Cannot analyze: GOOGLE_API_KEY not found")
-        state["analysis"] = "Analysis failed: API key not available"
-        return state
-    
-    try:
-        llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", api_key=api_key)
-        
-        if not state["metrics"] or not state["ratios"]:
-            print("⚠️  No metrics or ratios available for analysis")
-            state["analysis"] = "Analysis failed: No financial data available"
-            return state
-            
-        prompt = f"""
+# Fixed part of the analysis prompt; it leads every request so Gemini can cache it
+SYSTEM_PROMPT_FINANCE = """
         You are a senior financial analyst. 
         Using the following financial data, provide:
         - Summary of performance
@@ -142,28 +277,27 @@ def analyze_statement(state: StatementState) -> StatementState:
         - Cost efficiency analysis
         - Recommendations for improvement
 
-        Extracted Metrics:
-        {state['metrics']}
-
-        Calculated Ratios:
-        {state['ratios']}
-        
         Please provide a clear, professional analysis in 3-4 paragraphs.
         """
-        
-        print("🤖 Requesting AI analysis from Gemini...")
-        result = llm.invoke(prompt)
-        state["analysis"] = result.content
-        print("✅ AI analysis completed successfully")
-        return state
-        
-    except Exception as e:
-        print(f"❌ Error during AI analysis: {e}")
-        state["analysis"] = f"Analysis failed: {str(e)}"
-        return state
+
+def build_analysis_prompt(state: StatementState) -> str:
+    """Build the Gemini prompt for a statement's metrics and ratios"""
+    metrics = json.dumps(state["metrics"], sort_keys=True, separators=(",", ":"))
+    ratios = json.dumps(state["ratios"], sort_keys=True, separators=(",", ":"))
+    return f"{SYSTEM_PROMPT_FINANCE}\n\nExtracted Metrics:\n{metrics}\n\nCalculated Ratios:\n{ratios}"
+
+def _has_data(state: StatementState) -> bool:
+    return bool(state["metrics"]) and bool(state["ratios"])
+
+def analyze_statement(state: StatementState) -> StatementState:
+    return analyze(state, "analysis", build_analysis_prompt, _has_data)
+
+async def analyze_statement_async(state: StatementState) -> StatementState:
+    """analyze_statement() for async callers, so the Gemini call does not hold a thread"""
+    return await aanalyze(state, "analysis", build_analysis_prompt, _has_data)
 
 # --- Build LangGraph ---
-memory = MemorySaver()
+# A linear pipeline has nothing to resume, so the graph runs without a checkpointer
 builder = StateGraph(StatementState)
 builder.add_node("read", read_statement)
 builder.add_node("ratios", calculate_ratios)
@@ -173,7 +307,12 @@ builder.add_edge(START, "read")
 builder.add_edge("read", "ratios")
 builder.add_edge("ratios", "analyze")
 builder.add_edge("analyze", END)
-graph = builder.compile(checkpointer=memory)
+graph = builder.compile()
+
+def run_pipeline(file_path: str) -> StatementState:
+    """Run read -> ratios -> analyze directly, without the graph's per-node state handling"""
+    state: StatementState = {"file_path": file_path}
+    return analyze_statement(calculate_ratios(read_statement(state)))
 
 # --- Main Execution ---
 if __name__ == "__main__":
@@ -191,8 +330,7 @@ if __name__ == "__main__":
     print(f"📄 Analyzing PDF: {pdf_file}")
     
     try:
-        config = {"configurable": {"thread_id": "analysis_thread"}}
-        state = graph.invoke({"file_path": pdf_file}, config=config)
+        state = run_pipeline(pdf_file)
         
         print("\n" + "=" * 50)
         print("📊 ANALYSIS RESULTS")
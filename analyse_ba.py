@@ -1,67 +1,195 @@
-from dotenv import load_dotenv
 import os
 import re
 from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.memory import MemorySaver
-from langchain_google_genai import ChatGoogleGenerativeAI
 from pypdf import PdfReader
-from collections import Counter
 from pathlib import Path
 import pandas as pd
 import numpy as np
 import json, datetime
+import importlib.util
+from itertools import islice
+from cache import cache_path, file_digest, is_fresh, schema_tag, write_atomic
+from gemini import aanalyze, analyze
 
-load_dotenv()
+try:
+    import openpyxl  # Streaming read-only xlsx reader, used when calamine is unavailable
+except ImportError:
+    openpyxl = None
 
 # Check if API key is available
 if not os.getenv("GOOGLE_API_KEY"):
     print("⚠️  Warning: GOOGLE_API_KEY not found in environment variables")
     print("Please set your Google API key in a .env file or environment variable")
 
+# pandas' Rust-based calamine engine parses xlsx/xls far faster than openpyxl/xlrd
+EXCEL_ENGINE = "calamine" if importlib.util.find_spec("python_calamine") else None
+
+# Rows whose Item Name mentions sales. Matched as a plain case-insensitive
+# substring, which pandas checks much faster than running the regex engine
+SALES_KEYWORD = "sales"
+
+# Columns the sales pipeline reads; anything else in the sheet is skipped at parse time
+SALES_COLUMNS = {
+    "Date", "Item Code", "Item Name", "Quantity Sold",
+    "Total Sale Value", "Customer ID", "Salesperson", "Channel"
+}
+
+# Narrow dtypes for the columns we aggregate. Customer ID stays text so leading
+# zeros survive, and the low-cardinality labels are categoricals for cheap groupby
+SALES_DTYPES = {
+    "Item Name": "string",
+    "Customer ID": "string",
+    "Channel": "category",
+    "Salesperson": "category",
+    "Total Sale Value": "float64",
+}
+
+# Part of the sales rows cache key, so cached frames are rebuilt when the columns,
+# dtypes or Excel engine change; bump the number when the reader itself changes
+# (2: entries are JSON table documents instead of pickles)
+SALES_ROWS_SCHEMA = schema_tag(2, sorted(SALES_COLUMNS), sorted(SALES_DTYPES.items()), EXCEL_ENGINE)
+
+# CSV files (and xlsx files streamed with openpyxl) are filtered chunk by chunk
+# so the full sheet is never held in memory
+CSV_CHUNK_ROWS = 100_000
+XLSX_CHUNK_ROWS = 10_000
+
+# Number of customers / items listed in the revenue rankings
+TOP_N = 10
+
+# Key for rows whose Channel, Salesperson, Customer ID or Item Name is blank
+UNKNOWN_LABEL = "Unknown"
+
+# Ratios sent to Gemini. The per-customer counter grows with the sheet, so the
+# prompt relies on the top-N rankings instead
+PROMPT_RATIOS = ("Total Sale", "Monthly Sales", "Monthly Growth", "Channel Data", "Salesperson Data", "Top Customers", "Top Items")
+
 # --- Define State ---
 class StatementState(TypedDict):
     file_path: str
     text: str
-    metrics: dict
+    metrics: pd.DataFrame  # Filtered sales rows; serialized only at the API boundary
     ratios: dict
     analysis: str
 
 # --- Step 1: Read and extract totals from xlsx ---
+def parse_sale_dates(dates: pd.Series) -> pd.Series:
+    """Parse the Date column into Timestamps, NaT where a cell is not a date
+
+    Numbers (data.xls stores 20250106) are read as yyyymmdd rather than epoch
+    nanoseconds, only text cells are parsed day-first, and cells the reader
+    already turned into datetimes are kept as they are.
+    """
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates
+    numbers = pd.to_numeric(dates, errors="coerce")
+    is_number = numbers.notna()
+    is_text = dates.map(lambda value: isinstance(value, str)).astype(bool) & ~is_number
+    parsed = pd.to_datetime(dates.where(~(is_number | is_text)), errors="coerce")
+    if is_number.any():
+        parsed[is_number] = pd.to_datetime(
+            numbers[is_number].astype("int64").astype(str), format="%Y%m%d", errors="coerce"
+        )
+    if is_text.any():
+        parsed[is_text] = pd.to_datetime(dates[is_text], dayfirst=True, errors="coerce", format="mixed")
+    return parsed
+
+def _sales_mask(df: pd.DataFrame) -> pd.Series:
+    """Select rows that contain Sales"""
+    return df['Item Name'].str.contains(SALES_KEYWORD, case=False, regex=False, na=False)
+
+def _iter_xlsx_chunks(file_path: str):
+    """Stream the first sheet of an xlsx in read-only mode as DataFrames of XLSX_CHUNK_ROWS rows"""
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        columns = {name: index for index, name in enumerate(header) if name in SALES_COLUMNS}
+        dtypes = {column: dtype for column, dtype in SALES_DTYPES.items() if column in columns}
+
+        while True:
+            batch = list(islice(rows, XLSX_CHUNK_ROWS))
+            if not batch:
+                break
+            yield pd.DataFrame(
+                {name: [row[index] if index < len(row) else None for row in batch] for name, index in columns.items()}
+            ).astype(dtypes)
+    finally:
+        workbook.close()
+
+def _concat_sales_chunks(chunks) -> pd.DataFrame:
+    """Filter each chunk to its sales rows as it arrives and join the survivors"""
+    filtered = pd.concat([chunk[_sales_mask(chunk)] for chunk in chunks], ignore_index=True)
+    # Chunks can see different category sets, so re-apply the categorical dtypes after concatenating
+    return filtered.astype(
+        {column: dtype for column, dtype in SALES_DTYPES.items() if dtype == "category" and column in filtered}
+    )
+
+def _read_sales_rows(file_path: str) -> pd.DataFrame:
+    """Load only the sales rows (and the columns we use) of a csv, xlsx or xls file"""
+    usecols = lambda column: column in SALES_COLUMNS
+    suffix = Path(file_path).suffix.lower()
+    if suffix == ".csv":
+        return _concat_sales_chunks(pd.read_csv(
+            file_path, usecols=usecols, dtype=SALES_DTYPES,
+            encoding_errors="replace", chunksize=CSV_CHUNK_ROWS
+        ))
+
+    # Without calamine, openpyxl's default full-DOM load is avoided by streaming the rows
+    if EXCEL_ENGINE is None and openpyxl is not None and suffix in (".xlsx", ".xlsm"):
+        return _concat_sales_chunks(_iter_xlsx_chunks(file_path))
+
+    df = pd.read_excel(file_path, engine=EXCEL_ENGINE, usecols=usecols, dtype=SALES_DTYPES)
+    return df[_sales_mask(df)]
+
 def read_statement(state: StatementState) -> StatementState:
     # Currently accepting csv, xlsx and xls files
     try:
-        #Extract data type
-        #data_type = Path(state["file_path"]).suffix
-        df = pd.read_excel(state["file_path"])
-        df = df.replace({np.nan: None}) #Sanitize df
-
-        # Convert datetime64 columns to strings
-        # df = df.applymap(
-        #     lambda x: x.strftime("%Y-%m-%d")
-        #     if isinstance(x, (datetime.datetime, datetime.date))
-        #     else x
-        # )
-        
-        #Insert warning if no extraction
-        print(f"✅ Successfully extracted dataframe from Excel")
+        # Re-runs on the same file skip parsing by reusing the cached sales rows
+        # Stored as a JSON table (the schema keeps the dtypes) rather than a pickle, which
+        # would run code for anyone able to write to a shared ANALYSIS_CACHE_DIR
+        rows_cache = cache_path("sales_rows", f"{file_digest(state['file_path'])}-{SALES_ROWS_SCHEMA}", ".json")
+        if is_fresh(rows_cache):
+            # Dates stay as read; parse_sale_dates() handles them
+            filtered_rows = pd.read_json(rows_cache, orient="table", convert_dates=False)
+            print("✅ Loaded sales rows from cache")
+        else:
+            #Extract data type
+            #data_type = Path(state["file_path"]).suffix
+            filtered_rows = _read_sales_rows(state["file_path"])
+
+            # Convert datetime64 columns to strings
+            # df = df.applymap(
+            #     lambda x: x.strftime("%Y-%m-%d")
+            #     if isinstance(x, (datetime.datetime, datetime.date))
+            #     else x
+            # )
+            
+            #Insert warning if no extraction
+            print("✅ Successfully extracted dataframe from Excel")
 
-        # Select rows that contain Sales
-        filtered_rows = df[df['Item Name'].str.contains(r'sales', case=False, na=False)]
+            write_atomic(rows_cache, filtered_rows.to_json(orient="table").encode("utf-8"))
         
-        state["metrics"] = filtered_rows.to_dict()
+        state["metrics"] = filtered_rows
         # print('test state after converting from df', state["metrics"])
         return state
         
     except Exception as e:
         print(f"❌ Error reading files: {e}")
         state["text"] = ""
-        state["metrics"] = {}
+        state["metrics"] = pd.DataFrame()
         return state
 
 # --- Step 2: Calculate Financial Ratios ---
+def _labels(column: pd.Series) -> pd.Series:
+    """Column as text with blanks as UNKNOWN_LABEL, so the ratio dicts keep JSON-safe str keys"""
+    return column.astype("string").fillna(UNKNOWN_LABEL)
+
 def calculate_ratios(state: StatementState) -> StatementState:
-    m = state["metrics"]
+    # Aggregate column-wise on the frame read_statement kept
+    df = state["metrics"]
+    m = df.columns
     ratios = {}
     
     print(f"\n📊 Calculating ratios from {len(m)} metrics...")
@@ -70,90 +198,107 @@ def calculate_ratios(state: StatementState) -> StatementState:
     # Collect all total sale value (List)
     if "Total Sale Value" in m:
         try:
-            ratios["Total Sale"] = sum(m["Total Sale Value"].values())
+            ratios["Total Sale"] = float(df["Total Sale Value"].sum())
             # print(ratios["Total Sale"])
             print(f"✅ Extracted Sales Data: {ratios['Total Sale']}")
-        except:
+        except (KeyError, TypeError, ValueError):
             print("⚠️  Cannot extract Total Sale data")
 
     # Collect all total units sold? Skip for now
 
-    # Sales + units sold per month(? <- To show growth in analyze_statement) Skip for now
+    # Sales per month and month-on-month growth, so the prompt can speak to growth without the raw rows
+    if "Date" in m and "Total Sale Value" in m:
+        try:
+            dates = parse_sale_dates(df["Date"])
+            dated = dates.notna().to_numpy()  # Rows whose Date could not be parsed are left out
+            months = pd.Categorical(dates[dated].dt.to_period("M"))
+            codes = months.codes
+            # One bincount pass sums every month at once
+            totals = np.bincount(
+                codes,
+                weights=df["Total Sale Value"].to_numpy(dtype="float64", na_value=0.0)[dated],
+                minlength=len(months.categories)
+            )
+            labels = months.categories.astype(str).tolist()
+            ratios["Monthly Sales"] = dict(zip(labels, totals.tolist()))
+            print(f"✅ Calculated Monthly Sales: {ratios['Monthly Sales']}")
+
+            previous, current = totals[:-1], totals[1:]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                growth = (current - previous) / previous * 100
+            ratios["Monthly Growth"] = {
+                label: f"{round(rate, 2)}%"
+                for label, rate in zip(labels[1:], growth.tolist()) if np.isfinite(rate)
+            }
+            print(f"✅ Calculated Monthly Growth: {ratios['Monthly Growth']}")
+        except (KeyError, TypeError, ValueError):
+            print("⚠️  Cannot generate Monthly Sales data")
 
     # Collect channel + revenue
     if "Channel" in m and "Total Sale Value" in m:
         try:
-            #This portion unusable because type changed to dictionary instead of pandas df
-            # channel_df = (
-            #     m.groupby("Channel")["Total Sale Value"]   #  Key = Channel
-            #     .sum()                                     #  Value = Total Sale Value 
-            #     .reset_index()
-            # )
-            
-            channels = m["Channel"]
-            values = m["Total Sale Value"]
-            channel_data = {}
-
-            for i in channels.keys():
-                ch = channels[i]
-                val = values[i]
-
-                if ch not in channel_data:
-                    channel_data[ch] = []
-
-                channel_data[ch].append(val)
-
-            ratios["Channel Data"] = channel_data
+            ratios["Channel Data"] = (
+                df.groupby(_labels(df["Channel"]), sort=False)["Total Sale Value"]               #  Key = Channel
+                .sum()                                                                 #  Value = Total Sale Value
+                .to_dict()
+            )
 
             print(f"✅ Calculated Channel Data: {ratios['Channel Data']}")
-        except:
+        except (KeyError, TypeError, ValueError):
             print("⚠️  Cannot generate Channel data")
     
     # Collect salesperson + revenue  
     if "Salesperson" in m and "Total Sale Value" in m:
         try:
-            sales_map = {}
-            salesperson_list = list(m["Salesperson"].values())
-            sales_list = list(m["Total Sale Value"].values())
-
-            for person, value in zip(salesperson_list, sales_list):
-                sales_map.setdefault(person, []).append(value)
-
-            ratios["Salesperson Data"] = sales_map
+            ratios["Salesperson Data"] = (
+                df.groupby(_labels(df["Salesperson"]), sort=False)["Total Sale Value"]
+                .sum()
+                .to_dict()
+            )
             print(f"✅ Calculated Salesperson Data: {ratios['Salesperson Data']}")
-        except:
+        except (KeyError, TypeError, ValueError):
             print("⚠️  Cannot generate Salesperson data")      
     
     # Collect customers (List)
     if "Customer ID" in m:
         try:
-            id_list = list(m["Customer ID"].values())
-            ratios["Customer ID Counter"] = Counter(id_list)
+            ratios["Customer ID Counter"] = _labels(df["Customer ID"]).value_counts().to_dict()
             print(f"✅ Extracted Customer Data: {ratios['Customer ID Counter']}")
-        except:
+        except (KeyError, TypeError, ValueError):
             print("⚠️  Cannot extract Customer ID data")
 
+    # Top customers and items by revenue give the prompt a compact view of the rows
+    if "Customer ID" in m and "Total Sale Value" in m:
+        try:
+            ratios["Top Customers"] = (
+                df.groupby(_labels(df["Customer ID"]), sort=False)["Total Sale Value"]
+                .sum()
+                .nlargest(TOP_N)
+                .to_dict()
+            )
+            print(f"✅ Calculated Top Customers: {ratios['Top Customers']}")
+        except (KeyError, TypeError, ValueError):
+            print("⚠️  Cannot generate Top Customers data")
+
+    if "Item Name" in m and "Total Sale Value" in m:
+        try:
+            ratios["Top Items"] = (
+                df.groupby(_labels(df["Item Name"]), sort=False)["Total Sale Value"]
+                .sum()
+                .nlargest(TOP_N)
+                .to_dict()
+            )
+            print(f"✅ Calculated Top Items: {ratios['Top Items']}")
+        except (KeyError, TypeError, ValueError):
+            print("⚠️  Cannot generate Top Items data")
+
     state["ratios"] = ratios
     print(f"📈 Calculated {len(ratios)} financial ratios")
     return state
 
 # --- Step 3: Analyze with Gemini ---
-def analyze_statement(state: StatementState) -> StatementState:
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        print("❌ Cannot analyze: GOOGLE_API_KEY not found")
-        state["analysis"] = "Analysis failed: API key not available"
-        return state
-    
-    try:
-        llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", api_key=api_key)
-        
-        if not (bool(state["metrics"])) or not (bool(state["ratios"])):
-            print("⚠️  No metrics or ratios available for analysis")
-            state["analysis"] = "Analysis failed: No financial data available"
-            return state
-        
-        prompt = f"""
+# Fixed part of the analysis prompt; it leads every request so Gemini can cache it
+SYSTEM_PROMPT_SALES = """
         You are a Senior Business Advisory analyst
         Using the following business advisory data, generate an analysis report and a summary section. 
         
@@ -180,29 +325,27 @@ def analyze_statement(state: StatementState) -> StatementState:
         - A final, separate paragraph titled Summary
 
         Do not add any extra fonts (no bolding, underline, etc.) other than the ones specified.
-        Extracted Metrics:
-        {state['metrics']}
-
-        Calculated Ratios:
-        {state['ratios']}
-        
         Please provide a clear, professional analysis in 3-4 paragraphs.
         """
-        # print('DEBUGGING PROMPT\n', prompt, '\nEND OF PROMPT\n')
-        
-        print("🤖 Requesting AI analysis from Gemini...")
-        result = llm.invoke(prompt)
-        state["analysis"] = result.content
-        print("✅ AI analysis completed successfully")
-        return state
-        
-    except Exception as e:
-        print(f"❌ Error during AI analysis: {e}")
-        state["analysis"] = f"Analysis failed: {str(e)}"
-        return state
+
+def build_analysis_prompt(state: StatementState) -> str:
+    """Build the Gemini prompt from the aggregated sales ratios (the raw rows are not sent)"""
+    prompt_ratios = {key: state["ratios"][key] for key in PROMPT_RATIOS if key in state["ratios"]}
+    ratios = json.dumps(prompt_ratios, separators=(",", ":"), ensure_ascii=False, default=str)
+    return f"{SYSTEM_PROMPT_SALES}\n\nCalculated Ratios:\n{ratios}"
+
+def _has_data(state: StatementState) -> bool:
+    return len(state["metrics"]) > 0 and len(state["ratios"]) > 0
+
+def analyze_statement(state: StatementState) -> StatementState:
+    return analyze(state, "analysis", build_analysis_prompt, _has_data)
+
+async def analyze_statement_async(state: StatementState) -> StatementState:
+    """analyze_statement() for async callers, so the Gemini call does not hold a thread"""
+    return await aanalyze(state, "analysis", build_analysis_prompt, _has_data)
 
 # --- Build LangGraph ---
-memory = MemorySaver()
+# A linear pipeline has nothing to resume, so the graph runs without a checkpointer
 builder = StateGraph(StatementState)
 builder.add_node("read", read_statement)
 builder.add_node("ratios", calculate_ratios)
@@ -212,7 +355,12 @@ builder.add_edge(START, "read")
 builder.add_edge("read", "ratios")
 builder.add_edge("ratios", "analyze")
 builder.add_edge("analyze", END)
-graph = builder.compile(checkpointer=memory)
+graph = builder.compile()
+
+def run_pipeline(file_path: str) -> StatementState:
+    """Run read -> ratios -> analyze directly, without the graph's per-node state handling"""
+    state: StatementState = {"file_path": file_path}
+    return analyze_statement(calculate_ratios(read_statement(state)))
 
 # --- Main Execution ---
 if __name__ == "__main__":
@@ -235,14 +383,13 @@ if __name__ == "__main__":
     print(f"📄 Analyzing xlsx: {xlsx_file}")
     
     try:
-        config = {"configurable": {"thread_id": "analysis_thread"}}
-        state = graph.invoke({"file_path": xlsx_file}, config=config)
+        state = run_pipeline(xlsx_file)
         
         print("\n" + "=" * 50)
         print("📊 ANALYSIS RESULTS")
         print("=" * 50)
 
-        if state["metrics"]:
+        if len(state["metrics"]):
             print("\n💰 Extracted Financial Metrics:")
             print(state["metrics"])
         else:
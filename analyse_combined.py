@@ -1,10 +1,8 @@
-from dotenv import load_dotenv
 import os
 import re
 from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
 from langgraph.checkpoint.memory import MemorySaver
-from langchain_google_genai import ChatGoogleGenerativeAI
 from pypdf import PdfReader
 from collections import Counter
 from pathlib import Path
@@ -12,14 +10,14 @@ import pandas as pd
 import numpy as np
 
 from analyse import (
-    graph as finance_graph,
+    run_pipeline as run_finance_pipeline,
 )
 
 from analyse_ba import (
-    graph as sales_graph,
+    run_pipeline as run_sales_pipeline,
 )
 
-load_dotenv()
+from gemini import aanalyze, analyze
 
 # Check if API key is available
 if not os.getenv("GOOGLE_API_KEY"):
@@ -37,78 +35,63 @@ class CombinedState(TypedDict):
     # combined_metrics: dict
 
 # --- Step 1: Create subgraph for financial analysis ---
-def run_financial_analysis(state: CombinedState) -> CombinedState:
+# The finance and sales steps run side by side, so each returns only the key it
+# owns; LangGraph merges the two updates before the combine step
+def run_financial_analysis(state: CombinedState) -> dict:
     print('Debug financial analysis called:', state["file_path_finance"])
     
     try:
-        result = finance_graph.invoke({"file_path": state["file_path_finance"]})
-        state["analysis_finance"] = result.get("analysis", "")
+        result = run_finance_pipeline(state["file_path_finance"])
         print(f"✅ Financial analysis completed")
+        return {"analysis_finance": result.get("analysis", "")}
 
     except Exception as e:
         print(f"❌ Error during financial analysis: {e}")
-        state["analysis_finance"] = f"Analysis failed: {e}"
-        return state
-    
-    return state
+        return {"analysis_finance": f"Analysis failed: {e}"}
 
 # --- Step 2: Create subgraph for sales analysis ---
-def run_sales_analysis(state: CombinedState) -> CombinedState:
+def run_sales_analysis(state: CombinedState) -> dict:
     try:
-        result = sales_graph.invoke({"file_path": state["file_path_sales"]})
-        state["analysis_sales"] = result.get("analysis", "")
+        result = run_sales_pipeline(state["file_path_sales"])
         # state["combined_ratios"]["ratio_finance"] = result.get("ratios")
         print(f"✅ Sales analysis completed")
+        return {"analysis_sales": result.get("analysis", "")}
 
     except Exception as e:
         print(f"❌ Error during sales analysis: {e}")
-        state["analysis_sales"] = f"Analysis failed: {e}"
-        return state
-    
-    return state
+        return {"analysis_sales": f"Analysis failed: {e}"}
 
 # --- Step 3: Combine analyses ---
-def combine_analyses(state: CombinedState) -> CombinedState:
-    api_key = os.getenv("GOOGLE_API_KEY")
-    
-    if not api_key:
-        print("❌ Cannot analyze: GOOGLE_API_KEY not found")
-        state["combined_analysis"] = "Analysis failed: API key not available"
-        # state["combined_ratios"]["ratio_finance"] = result.get("ratios")
-        return state
-    
-    try:
-        llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", api_key=api_key)
-        if not (bool(state["analysis_finance"])) or not (bool(state["analysis_sales"])):
-            print("⚠️  No analysis available for merging")
-            state["combined_analysis"] = "Analysis failed: No financial or sales data available"
-            return state
-
-        prompt = f"""
+# The instructions never change, so they lead the prompt byte-for-byte and only the two
+# analyses vary at the end; Gemini's implicit prefix cache can then reuse the instructions
+COMBINE_INSTRUCTIONS = """
         You are a Senior Business Advisory analyst who needs to generate a report containing information about your company's financial status and operation, and overall business suggestion.
 
         You have two analysis reports generated from financial statement and sales statement. Merge the two analysis reports into one comprehensive report.
-        
+
+        Please provide a clear, professional analysis with one paragraph each containing information about your company's financial status, their operation details, and overall business suggestion.
+        """
+
+def _has_analyses(state: CombinedState) -> bool:
+    return bool(state["analysis_finance"]) and bool(state["analysis_sales"])
+
+def _combine_prompt(state: CombinedState) -> str:
+    return f"""{COMBINE_INSTRUCTIONS}
         Financial Analysis:
         {state['analysis_finance']}
 
         Sales Analysis:
         {state['analysis_sales']}
-
-        Please provide a clear, professional analysis with one paragraph each containing information about your company's financial status, their operation details, and overall business suggestion.
         """
 
-        # print('DEBUG prompt:', prompt, '\n\n')
-        print("🤖 Requesting AI combination from Gemini...")
-        result = llm.invoke(prompt)
-        state["combined_analysis"] = result.content
-        print(f"✅ Combined analysis generated")
-        return state
+def combine_analyses(state: CombinedState) -> CombinedState:
+    return analyze(state, "combined_analysis", _combine_prompt, _has_analyses,
+                   no_data="No financial or sales data available")
 
-    except Exception as e:
-        print(f"❌ Error when combining analysis data: {e}")
-        state["combined_analysis"] = f"Analysis failed: {str(e)}"
-        return state
+async def combine_analyses_async(state: CombinedState) -> CombinedState:
+    """combine_analyses() for async callers, so the Gemini call does not hold a thread"""
+    return await aanalyze(state, "combined_analysis", _combine_prompt, _has_analyses,
+                          no_data="No financial or sales data available")
 
 # Step 3.1: Combine ratios and metrics
 # def combine_ratios(state: CombinedState) -> CombinedState:
@@ -121,9 +104,10 @@ builder.add_node("finance", run_financial_analysis)
 builder.add_node("sales", run_sales_analysis)
 builder.add_node("combined", combine_analyses)
 
+# Fan out: finance and sales share no state, so they run concurrently and both feed combined
 builder.add_edge(START, "finance")
-builder.add_edge("finance", "sales")
-builder.add_edge("sales", "combined")
+builder.add_edge(START, "sales")
+builder.add_edge(["finance", "sales"], "combined")
 builder.add_edge("combined", END)
 
 graph = builder.compile(checkpointer=memory)
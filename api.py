@@ -1,47 +1,58 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks
-from fastapi.responses import JSONResponse, FileResponse
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
+from starlette.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any
 import os
 import re
 import uuid
+import heapq
+import itertools
+import time
+from collections import Counter
+import hashlib
 import asyncio
+import aiofiles
+import aiofiles.os
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+import io
 import json
+import orjson
+from functools import lru_cache
 from pathlib import Path
-import pandas as pd  # For reading Excel files
+import pandas as pd  # Empty sales frame in run_excel_extraction; analyse_ba loads pandas anyway
 
 # Finance/PDF analysis
 from analyse import read_statement as read_pdf_statement
 from analyse import calculate_ratios as calculate_pdf_ratios
-from analyse import analyze_statement as analyze_pdf_statement
+from analyse import analyze_statement_async as analyze_pdf_statement_async
+from analyse import build_analysis_prompt as build_pdf_prompt
 from analyse import StatementState as PDFStatementState
 
 # Sales/Excel analysis
 from analyse_ba import read_statement as read_excel_statement
 from analyse_ba import calculate_ratios as calculate_excel_ratios
-from analyse_ba import analyze_statement as analyze_excel_statement
+from analyse_ba import analyze_statement_async as analyze_excel_statement_async
+from analyse_ba import build_analysis_prompt as build_excel_prompt
 from analyse_ba import StatementState as ExcelStatementState
 
 # Combined/Business Advisory analysis
+from gemini import acomplete_batch
+from store import Store, make_store
+from cache import file_digest, write_atomic
+from cors import FastCORS
+
 from analyse_combined import (
     CombinedState, 
-    run_financial_analysis, run_sales_analysis, combine_analyses
+    run_financial_analysis, run_sales_analysis, combine_analyses_async
 )
 
-# New imports for PDF/chart generation
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import cm
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib.styles import getSampleStyleSheet
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-import numpy as np
+# ReportLab (PDF/chart generation) is imported inside the report helpers, so only
+# the /report endpoint pays for loading it
 
+# Read once; the analysis modules have loaded .env by now
+GOOGLE_API_KEY_SET = bool(os.getenv("GOOGLE_API_KEY"))
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -53,18 +64,55 @@ app = FastAPI(
 )
 
 # Ensure runtime dirs exist
-Path("uploads").mkdir(exist_ok=True)
+UPLOAD_DIR = os.path.normpath(os.getenv("UPLOAD_DIR", "uploads"))
+os.makedirs(UPLOAD_DIR, exist_ok=True)
 Path("reports").mkdir(exist_ok=True)
-Path("charts").mkdir(exist_ok=True)
-
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+
+# Largest accepted upload request; larger ones are refused before the body is read
+MAX_UPLOAD_BYTES = int(os.getenv("ANALYSIS_MAX_UPLOAD_MB", "50")) * 1024 * 1024
+
+class UploadSizeLimit:
+    """Answer 413 to upload requests whose Content-Length is over MAX_UPLOAD_BYTES
+
+    FastAPI parses the whole multipart form before an endpoint runs, so the
+    check has to happen here to keep oversized files off the disk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"].startswith("/analyze/"):
+            content_length = dict(scope["headers"]).get(b"content-length")
+            if content_length is not None and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+                body = orjson.dumps({"detail": f"Upload too large (limit {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)"})
+                await send({"type": "http.response.start", "status": 413, "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"connection", b"close"),
+                ]})
+                await send({"type": "http.response.body", "body": body})
+                return
+        await self.app(scope, receive, send)
+
+app.add_middleware(UploadSizeLimit)
+
+# Add CORS middleware (allow-all, with the headers pre-built; see cors.py)
+app.add_middleware(FastCORS)
+
+class JSONGZipMiddleware(GZipMiddleware):
+    """GZip for JSON responses; PDF reports are already deflate-compressed and keep sendfile,
+    and status streams must reach the client event by event rather than in compressor-sized blocks
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(("/report/", "/status/stream/")):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# Compress larger responses (results with AI analysis text, the /queue dump)
+app.add_middleware(JSONGZipMiddleware, minimum_size=1024, compresslevel=6)
 
 # Data models
 class AnalysisRequest(BaseModel):
@@ -89,168 +137,292 @@ class AnalysisResult(BaseModel):
     timestamp: str
     processing_time: float
 
-# Storage for analysis results (in production, use a proper database)
-analysis_results: Dict[str, AnalysisResult] = {}
-analysis_queue: Dict[str, Dict[str, Any]] = {}
+def is_upload(file_path: str) -> bool:
+    """Whether a path is one of our saved uploads rather than a file named by /analyze/file"""
+    return os.path.dirname(file_path) == UPLOAD_DIR
+
+def discard_upload(queue_info: Dict[str, Any]):
+    """Delete the uploaded files of a finished queue entry dropped from the in-memory store
+
+    run_pipeline already removes them once the job finishes; this catches any it could not.
+    """
+    if queue_info.get("status") not in ("completed", "failed"):
+        return
+    for file_path in queue_info.get("uploads", [queue_info.get("file_path")]):
+        if file_path and is_upload(file_path):
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+
+# Storage for analysis results (memory by default, SQLite/Redis via ANALYSIS_STORE)
+analysis_results: Store = make_store("pdf_results")
+analysis_queue: Store = make_store("pdf_queue", on_evict=discard_upload)
 
 # Storage for Excel analysis results
-excel_analysis_results: Dict[str, Any] = {}
-excel_analysis_queue: Dict[str, Any] = {}
+excel_analysis_results: Store = make_store("excel_results")
+excel_analysis_queue: Store = make_store("excel_queue", on_evict=discard_upload)
 
 # Storage for Business Advisory analysis results
-ba_analysis_results: Dict[str, Any] = {}
-ba_analysis_queue: Dict[str, Any] = {}
+ba_analysis_results: Store = make_store("ba_results")
+ba_analysis_queue: Store = make_store("ba_queue", on_evict=discard_upload)
+
+# Finished requests are kept for a day, then expire from the store
+RESULT_TTL_SECONDS = 24 * 60 * 60
+
+# Completed results indexed by pipeline, analysis type and input file contents,
+# so re-uploading the same file reuses the earlier analysis
+results_by_content: Store = make_store("results_by_content")
+
+# Every uvicorn worker (WEB_CONCURRENCY, set by start_prod.py) imports this module,
+# so each one sizes its pools to its own share of the CPUs rather than all of them
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+CPU_SHARE = max(1, (os.cpu_count() or 1) // max(1, WEB_CONCURRENCY))
+
+# PDF/spreadsheet parsing and ratio maths run in worker processes so they never block the event loop
+PIPELINE_PROCESSES = int(os.getenv("PIPELINE_PROCESSES", str(CPU_SHARE)))
+PIPELINE_EXECUTOR = ProcessPoolExecutor(max_workers=PIPELINE_PROCESSES)
+
+# Analyses wait in a bounded job queue for one of ANALYSIS_WORKERS worker tasks;
+# once it is full, new requests get a 503 instead of piling up behind the rest
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", str(CPU_SHARE)))
+JOB_QUEUE_SIZE = int(os.getenv("ANALYSIS_QUEUE_SIZE", "100"))
+job_queue: asyncio.Queue = asyncio.Queue(maxsize=JOB_QUEUE_SIZE)
+worker_tasks: list = []
+
+async def analysis_worker():
+    """Run queued analyses one at a time"""
+    while True:
+        process, args = await job_queue.get()
+        try:
+            await process(*args)
+        except Exception as e:
+            # process_* record their own failures; this only keeps the worker alive
+            print(f"❌ Unhandled error in analysis worker: {e}")
+        finally:
+            job_queue.task_done()
+
+@app.on_event("startup")
+async def start_workers():
+    worker_tasks.extend(asyncio.create_task(analysis_worker()) for _ in range(ANALYSIS_WORKERS))
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    for task in worker_tasks:
+        task.cancel()
+    worker_tasks.clear()
+    PIPELINE_EXECUTOR.shutdown(cancel_futures=True)
+
+def check_capacity():
+    """Reject a request up front when the job queue is already full"""
+    if job_queue.full():
+        raise HTTPException(status_code=503, detail="Analysis queue is full, please retry later")
+
+async def submit_job(queue: Store, request_id: str, entry: Dict[str, Any], process, *args, uploads: tuple = ()):
+    """Record a queued request and hand it to the workers
+
+    Every upload is recorded in the entry, so discard_upload() can remove them
+    all. They are removed again if the job queue filled up while they were being saved.
+    """
+    if job_queue.full():
+        for path in uploads:
+            await cleanup_file(path)
+    check_capacity()
+    if uploads:
+        entry["uploads"] = list(uploads)
+    await queue.aset(request_id, entry)
+    job_queue.put_nowait((process, (request_id, *args)))
 
 # Utility functions
-def save_uploaded_file(upload_file: UploadFile) -> str:
+_id_counter = itertools.count()
+
+def new_request_id() -> str:
+    """Time-ordered UUID (version 7 layout) for request ids
+
+    Ids sort by creation time, which keeps recent entries together in the
+    SQLite/Redis stores; a per-process counter in the random bits keeps ids
+    from one process unique within the same millisecond.
+    """
+    timestamp_ms = time.time_ns() // 1_000_000
+    counter = next(_id_counter) & 0xFFF
+    random_bits = int.from_bytes(os.urandom(8), "big") & ((1 << 62) - 1)
+    value = (timestamp_ms & ((1 << 48) - 1)) << 80 | 0x7 << 76 | counter << 64 | 0b10 << 62 | random_bits
+    return str(uuid.UUID(int=value))
+
+# Uploads are copied to disk in chunks of this size instead of being read whole
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# SHA-1 of each saved upload, computed while it streams to disk so content_key()
+# doesn't have to read the file back just to hash it
+upload_digests: Dict[str, str] = {}
+
+async def stream_upload(upload_file: UploadFile, file_path: str):
+    """Copy an upload to disk chunk by chunk, hashing it on the way
+
+    Uploads sent without a Content-Length are cut off at MAX_UPLOAD_BYTES here.
+    """
+    digest = hashlib.sha1()
+    size = 0
+    # "x" creates the file exclusively in the open call, so an existing file is never overwritten
+    async with aiofiles.open(file_path, "xb") as buffer:
+        while chunk := await upload_file.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                break
+            digest.update(chunk)
+            await buffer.write(chunk)
+    if size > MAX_UPLOAD_BYTES:
+        await aiofiles.os.remove(file_path)
+        raise HTTPException(status_code=413, detail=f"Upload too large (limit {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)")
+    upload_digests[file_path] = digest.hexdigest()
+
+# Accepted upload types, by lowercased file extension
+PDF_EXTENSIONS = frozenset({".pdf"})
+SPREADSHEET_EXTENSIONS = frozenset({".xlsx", ".xls", ".csv"})
+
+def upload_extension(upload_file: UploadFile) -> str:
+    return os.path.splitext(upload_file.filename)[1].lower()
+
+async def save_uploaded_file(upload_file: UploadFile) -> str:
     """Save uploaded file and return the file path"""
-    upload_dir = Path("uploads")
-    upload_dir.mkdir(exist_ok=True)
-    
     # Generate unique filename
-    file_extension = Path(upload_file.filename).suffix
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = upload_dir / unique_filename
+    file_extension = os.path.splitext(upload_file.filename)[1]
+    file_path = f"{UPLOAD_DIR}/{uuid.uuid4()}{file_extension}"
     
-    # Save file
-    with open(file_path, "wb") as buffer:
-        content = upload_file.file.read()
-        buffer.write(content)
+    # Stream the upload to disk without blocking the event loop
+    await stream_upload(upload_file, file_path)
     
-    return str(file_path)
+    return file_path
 
-def save_uploaded_excel(upload_file: UploadFile) -> str:
-    upload_dir = Path("uploads")
-    upload_dir.mkdir(exist_ok=True)
-    file_extension = Path(upload_file.filename).suffix
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = upload_dir / unique_filename
+async def save_uploaded_excel(upload_file: UploadFile) -> str:
+    file_extension = os.path.splitext(upload_file.filename)[1]
+    file_path = f"{UPLOAD_DIR}/{uuid.uuid4()}{file_extension}"
 
-    with open(file_path, "wb") as buffer:
-        content = upload_file.file.read()
-        buffer.write(content)
+    await stream_upload(upload_file, file_path)
     
-    return str(file_path)
+    return file_path
     
-def cleanup_file(file_path: str):
+def json_response(data: Dict[str, Any]) -> Response:
+    """Serialize a stored result with orjson, bypassing FastAPI's encoder walk"""
+    return Response(content=orjson.dumps(data), media_type="application/json")
+
+async def cleanup_file(file_path: str):
     """Remove temporary file"""
+    upload_digests.pop(file_path, None)
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            print(f"✅ Cleaned up temporary file: {file_path}")
+        await aiofiles.os.remove(file_path)
+        print(f"✅ Cleaned up temporary file: {file_path}")
+    except FileNotFoundError:
+        pass
     except Exception as e:
         print(f"⚠️  Warning: Could not clean up file {file_path}: {e}")
 
-async def process_analysis(request_id: str, file_path: str, analysis_type: str):
-    """Background task to process the analysis"""
-    start_time = datetime.now()
-    
-    try:
-        # Update status to processing
-        analysis_queue[request_id]["status"] = "processing"
-        
-        # Create initial state
-        state = PDFStatementState(
-            file_path=file_path,
-            text="",
-            metrics={},
-            ratios={},
-            analysis=""
-        )
-        
-        # Execute analysis pipeline
-        if analysis_type in ["metrics", "full"]:
-            state = read_pdf_statement(state)
-        
-        if analysis_type in ["ratios", "full"] and state["metrics"]:
-            state = calculate_pdf_ratios(state)
-        
-        if analysis_type == "full" and state["metrics"] and state["ratios"]:
-            state = analyze_pdf_statement(state)
-        
-        # Calculate processing time
-        processing_time = (datetime.now() - start_time).total_seconds()
-        
-        # Create result
-        result = AnalysisResult(
-            request_id=request_id,
-            status="completed",
-            metrics=state["metrics"],
-            ratios=state["ratios"],
-            analysis=state["analysis"],
-            text_length=len(state["text"]),
-            timestamp=datetime.now().isoformat(),
-            processing_time=processing_time
-        )
-        
-        # Store result
-        analysis_results[request_id] = result
-        analysis_queue[request_id]["status"] = "completed"
-        
-        # Cleanup temporary file
-        cleanup_file(file_path)
-        
-    except Exception as e:
-        processing_time = (datetime.now() - start_time).total_seconds()
-        error_result = AnalysisResult(
-            request_id=request_id,
-            status="failed",
-            metrics={},
-            ratios={},
-            analysis=f"Analysis failed: {str(e)}",
-            text_length=0,
-            timestamp=datetime.now().isoformat(),
-            processing_time=processing_time
-        )
-        analysis_results[request_id] = error_result
-        analysis_queue[request_id]["status"] = "failed"
-        analysis_queue[request_id]["error"] = str(e)
+async def content_key(pipeline: str, analysis_type: str, *file_paths: str) -> str:
+    """Key identifying an analysis by what was analyzed rather than by request
+
+    Files without a digest from upload streaming are hashed in a thread, since
+    reading a large file would otherwise stall the event loop.
+    """
+    digests = [upload_digests.pop(path, None) or await asyncio.to_thread(file_digest, path)
+               for path in file_paths]
+    return ":".join([pipeline, analysis_type, *digests])
+
+async def reuse_result(key: str, request_id: str, start: float) -> Optional[Dict[str, Any]]:
+    """Return an earlier result for the same content, re-labelled for this request"""
+    result = await results_by_content.aget(key)
+    if result is None:
+        return None
+    print(f"✅ Reusing analysis of identical content for {request_id}")
+    return {
+        **result,
+        "request_id": request_id,
+        "timestamp": datetime.now().isoformat(),
+        "processing_time": time.monotonic() - start
+    }
 
-async def process_excel_analysis(request_id: str, file_path: str, analysis_type: str):
-    start_time = datetime.now()
-    try:
-        excel_analysis_queue[request_id]["status"] = "processing"
+async def remember_result(key: str, result: Dict[str, Any]):
+    """Index a completed result by content; failed AI analyses are retried next time"""
+    analyses = [value for field, value in result.items() if field.startswith("analysis")]
+    if not any(str(value).startswith("Analysis failed") for value in analyses):
+        await results_by_content.aset(key, result, ttl=RESULT_TTL_SECONDS)
+
+def run_pdf_extraction(file_path: str, analysis_type: str) -> PDFStatementState:
+    """Read metrics and calculate ratios for a PDF; runs in PIPELINE_EXECUTOR"""
+    state = PDFStatementState(
+        file_path=file_path,
+        text="",
+        metrics={},
+        ratios={},
+        analysis=""
+    )
 
-        # Initialize state (similar to PDF StatementState)
-        state: ExcelStatementState = {
-            "file_path": file_path,
-            "text": "",
-            "metrics": {},
-            "ratios": {},
-            "analysis": ""
-        }
+    if analysis_type in ["metrics", "full"]:
+        state = read_pdf_statement(state)
 
-        # Step 1: Extract metrics
-        if analysis_type in ["metrics", "full"]:
-            state = read_excel_statement(state)
+    if analysis_type in ["ratios", "full"] and state["metrics"]:
+        state = calculate_pdf_ratios(state)
 
-        # Step 2: Calculate ratios (reuse existing calculate_ratios if compatible)
-        if analysis_type in ["ratios", "full"] and state["metrics"]:
-            state = calculate_excel_ratios(state)
+    return state
 
-        # Step 3: AI analysis
-        if analysis_type == "full" and state["metrics"] and state["ratios"]:
-            state = analyze_excel_statement(state)
+async def run_pdf_pipeline(analysis_type: str, file_path: str) -> Dict[str, Any]:
+    """Extract in a worker process, then analyze with Gemini on the event loop"""
+    loop = asyncio.get_running_loop()
+    state = await loop.run_in_executor(PIPELINE_EXECUTOR, run_pdf_extraction, file_path, analysis_type)
 
-        # Processing time
-        processing_time = (datetime.now() - start_time).total_seconds()
+    if analysis_type == "full" and state["metrics"] and state["ratios"]:
+        state = await analyze_pdf_statement_async(state)
 
-        # Store result
-        excel_analysis_results[request_id] = {
-            "request_id": request_id,
-            "status": "completed",
-            "metrics": state["metrics"],
-            "ratios": state["ratios"],
-            "analysis": state["analysis"],
-            "text_length": len(state["text"]),
-            "timestamp": datetime.now().isoformat(),
-            "processing_time": processing_time
-        }
-        excel_analysis_queue[request_id]["status"] = "completed"
+    return {
+        "metrics": state["metrics"],
+        "ratios": state["ratios"],
+        "analysis": state["analysis"],
+        "text_length": len(state["text"])
+    }
+
+# Status stream subscribers waiting on a request, woken by notify_status() when this
+# process changes its status (other workers' changes are picked up by polling)
+status_waiters: Dict[str, asyncio.Event] = {}
+# Open status streams per request; its waiter is dropped once the last one ends, since a
+# job finished by another worker or a client hanging up never reaches notify_status()
+status_subscribers: Counter = Counter()
+
+def notify_status(request_id: str):
+    waiter = status_waiters.pop(request_id, None)
+    if waiter is not None:
+        waiter.set()
+
+async def run_pipeline(kind: str, request_id: str, analysis_type: str, *file_paths: str) -> bool:
+    """Run one queued analysis of PIPELINES[kind] and store its result
+
+    Status updates, reuse of results for identical content, the failure result
+    and removing the uploaded input files afterwards are the same for every
+    pipeline. Returns whether the job completed.
+    """
+    queue, results, pipeline = PIPELINES[kind]
+    start = time.monotonic()
+    try:
+        await queue.aupdate(request_id, status="processing")
+        notify_status(request_id)
+
+        key = await content_key(kind, analysis_type, *file_paths)
+        result = await reuse_result(key, request_id, start)
+        if result is None:
+            result = {
+                "request_id": request_id,
+                "status": "completed",
+                **await pipeline(analysis_type, *file_paths),
+                "timestamp": datetime.now().isoformat(),
+                "processing_time": time.monotonic() - start
+            }
+            await remember_result(key, result)
+
+        await results.aset(request_id, result, ttl=RESULT_TTL_SECONDS)
+        await queue.aupdate(request_id, ttl=RESULT_TTL_SECONDS, status="completed")
+        notify_status(request_id)
+        return True
 
     except Exception as e:
-        processing_time = (datetime.now() - start_time).total_seconds()
-        excel_analysis_results[request_id] = {
+        await results.aset(request_id, {
             "request_id": request_id,
             "status": "failed",
             "metrics": {},
@@ -258,96 +430,153 @@ async def process_excel_analysis(request_id: str, file_path: str, analysis_type:
             "analysis": f"Analysis failed: {str(e)}",
             "text_length": 0,
             "timestamp": datetime.now().isoformat(),
-            "processing_time": processing_time
-        }
-        excel_analysis_queue[request_id]["status"] = "failed"
-        excel_analysis_queue[request_id]["error"] = str(e)
+            "processing_time": time.monotonic() - start
+        }, ttl=RESULT_TTL_SECONDS)
+        await queue.aupdate(request_id, ttl=RESULT_TTL_SECONDS, status="failed", error=str(e))
+        notify_status(request_id)
+        return False
 
-async def process_ba_analysis(request_id: str, file_path_finance: str, file_path_sales: str, analysis_type: str):
-    start_time = datetime.now()
-    try:
-        ba_analysis_queue[request_id]["status"] = "processing"
+    finally:
+        await asyncio.gather(*(cleanup_file(path) for path in file_paths if is_upload(path)))
 
-        # Initialize finance and sales states
-        state_finance: PDFStatementState = {
-            "file_path": file_path_finance, "text": "", "metrics": {}, "ratios": {}, "analysis": ""
-        }
-        
-        state_sales: ExcelStatementState = {
-            "file_path": file_path_sales, "text": "", "metrics": {}, "ratios": {}, "analysis": ""
-        }
+async def process_analysis(request_id: str, file_path: str, analysis_type: str):
+    """Background task to process the analysis"""
+    if await run_pipeline("pdf", request_id, analysis_type, file_path):
+        # Uploads are already gone; a file named through /analyze/file is removed here as before
+        await cleanup_file(file_path)
+
+def frame_to_dict(df) -> dict:
+    """Serialize a sales DataFrame as a column -> {row: value} dict, missing cells as None
+
+    pandas' JSON writer maps NaN to null column by column, so the frame is never
+    copied into an object-dtype version of itself first.
+    """
+    return json.loads(df.to_json(date_format="iso"))
+
+def run_excel_extraction(file_path: str, analysis_type: str) -> ExcelStatementState:
+    """Read sales rows and calculate ratios for a spreadsheet; runs in PIPELINE_EXECUTOR"""
+    state: ExcelStatementState = {
+        "file_path": file_path,
+        "text": "",
+        "metrics": pd.DataFrame(),
+        "ratios": {},
+        "analysis": ""
+    }
 
-        # Individual state analysis
-        if analysis_type in ["metrics", "full"]:
-            state_finance = read_pdf_statement(state_finance)
-            state_sales = read_excel_statement(state_sales)
+    if analysis_type in ["metrics", "full"]:
+        state = read_excel_statement(state)
 
-        if analysis_type in ["ratios", "full"] and state_finance["metrics"]:
-            state_finance = calculate_pdf_ratios(state_finance)
+    if analysis_type in ["ratios", "full"] and len(state["metrics"]):
+        state = calculate_excel_ratios(state)
 
-        if analysis_type == "full" and state_finance["metrics"] and state_finance["ratios"]:
-            state_finance = analyze_pdf_statement(state_finance)
+    return state
 
-        if analysis_type in ["ratios", "full"] and state_sales["metrics"]:
-            state_sales = calculate_excel_ratios(state_sales)
+async def run_excel_pipeline(analysis_type: str, file_path: str) -> Dict[str, Any]:
+    # Steps 1-2 (extract metrics, calculate ratios) run in a worker process
+    loop = asyncio.get_running_loop()
+    state = await loop.run_in_executor(PIPELINE_EXECUTOR, run_excel_extraction, file_path, analysis_type)
 
-        if analysis_type == "full" and state_sales["metrics"] and state_sales["ratios"]:
-            state_sales = analyze_excel_statement(state_sales)
+    # Step 3: AI analysis
+    if analysis_type == "full" and len(state["metrics"]) and state["ratios"]:
+        state = await analyze_excel_statement_async(state)
 
-        # Initialize combined state
-        state_combined: CombinedState = {
-            "file_path_finance": file_path_finance,
-            "file_path_sales": file_path_sales,
-            "analysis_finance": state_finance["analysis"],
-            "analysis_sales": state_sales["analysis"],
-            "combined_analysis": "",
-            # "combined_ratios": {}
-        }
+    return {
+        "metrics": frame_to_dict(state["metrics"]),
+        "ratios": state["ratios"],
+        "analysis": state["analysis"],
+        "text_length": len(state["text"])
+    }
 
-        # Combine analyses
-        if state_combined["analysis_finance"] and state_combined["analysis_sales"]:
-            state_combined = combine_analyses(state_combined)
+async def process_excel_analysis(request_id: str, file_path: str, analysis_type: str):
+    await run_pipeline("spreadsheet", request_id, analysis_type, file_path)
+
+async def analyze_batch(pending: list):
+    """Analyze several (state, prompt builder) pairs with a single batched Gemini call"""
+    if not pending:
+        return
+
+    if not GOOGLE_API_KEY_SET:
+        print("❌ Cannot analyze: GOOGLE_API_KEY not found")
+        for state, _ in pending:
+            state["analysis"] = "Analysis failed: API key not available"
+        return
+
+    prompts = [build_prompt(state) for state, build_prompt in pending]
+
+    print(f"🤖 Requesting {len(prompts)} AI analyses from Gemini in one batch...")
+    results = await acomplete_batch(prompts)
+    for (state, _), result in zip(pending, results):
+        if isinstance(result, Exception):
+            print(f"❌ Error during AI analysis: {result}")
+            state["analysis"] = f"Analysis failed: {str(result)}"
+        else:
+            state["analysis"] = result
+
+async def run_ba_pipeline(analysis_type: str, file_path_finance: str, file_path_sales: str) -> Dict[str, Any]:
+    # The finance and sales pipelines share nothing until they are combined, so they
+    # run side by side in the worker processes
+    loop = asyncio.get_running_loop()
+    state_finance, state_sales = await asyncio.gather(
+        loop.run_in_executor(PIPELINE_EXECUTOR, run_pdf_extraction, file_path_finance, analysis_type),
+        loop.run_in_executor(PIPELINE_EXECUTOR, run_excel_extraction, file_path_sales, analysis_type)
+    )
 
-            # combined_ratios = {
-            #     "finance_ratios": state_finance.get("ratios", {}),
-            #     "sales_ratios": state_sales.get("ratios", {})
-            # }
+    # Both reports go to Gemini in one batched call instead of two sequential invokes
+    if analysis_type == "full":
+        pending = []
+        if state_finance["metrics"] and state_finance["ratios"]:
+            pending.append((state_finance, build_pdf_prompt))
+        if len(state_sales["metrics"]) and state_sales["ratios"]:
+            pending.append((state_sales, build_excel_prompt))
+        await analyze_batch(pending)
+
+    # Initialize combined state
+    state_combined: CombinedState = {
+        "file_path_finance": file_path_finance,
+        "file_path_sales": file_path_sales,
+        "analysis_finance": state_finance["analysis"],
+        "analysis_sales": state_sales["analysis"],
+        "combined_analysis": "",
+        # "combined_ratios": {}
+    }
 
-        # Processing time
-        processing_time = (datetime.now() - start_time).total_seconds()
+    # Combine analyses
+    if state_combined["analysis_finance"] and state_combined["analysis_sales"]:
+        state_combined = await combine_analyses_async(state_combined)
 
-        # Store result
-        ba_analysis_results[request_id] = {
-            "request_id": request_id,
-            "status": "completed",
-            # "metrics": state_sales["metrics"], # Placeholder using sales variables
-            # "ratios": state_sales["ratios"], # Placeholder using sales variables
-            "analysis": state_combined["combined_analysis"],
-            "analysis_finance": state_finance["analysis"],
-            "analysis_sales": state_sales["analysis"],
-            "text_length": len(state_sales["text"]) + len(state_finance["text"]),
-            "timestamp": datetime.now().isoformat(),
-            "processing_time": processing_time
-        }
-        ba_analysis_queue[request_id]["status"] = "completed"
+        # combined_ratios = {
+        #     "finance_ratios": state_finance.get("ratios", {}),
+        #     "sales_ratios": state_sales.get("ratios", {})
+        # }
 
-    except Exception as e:
-        processing_time = (datetime.now() - start_time).total_seconds()
-        ba_analysis_results[request_id] = {
-            "request_id": request_id,
-            "status": "failed",
-            "metrics": {},
-            "ratios": {},
-            "analysis": f"Analysis failed: {str(e)}",
-            "text_length": 0,
-            "timestamp": datetime.now().isoformat(),
-            "processing_time": processing_time
-        }
-        ba_analysis_queue[request_id]["status"] = "failed"
-        ba_analysis_queue[request_id]["error"] = str(e)
+    return {
+        # "metrics": state_sales["metrics"], # Placeholder using sales variables
+        # "ratios": state_sales["ratios"], # Placeholder using sales variables
+        "analysis": state_combined["combined_analysis"],
+        "analysis_finance": state_finance["analysis"],
+        "analysis_sales": state_sales["analysis"],
+        "text_length": len(state_sales["text"]) + len(state_finance["text"])
+    }
+
+async def process_ba_analysis(request_id: str, file_path_finance: str, file_path_sales: str, analysis_type: str):
+    await run_pipeline("business-advisory", request_id, analysis_type, file_path_finance, file_path_sales)
+
+# Pipeline name (also the first part of its content key) -> (queue, results, coroutine
+# turning the analysis type and input files into the pipeline-specific result fields)
+PIPELINES = {
+    "pdf": (analysis_queue, analysis_results, run_pdf_pipeline),
+    "spreadsheet": (excel_analysis_queue, excel_analysis_results, run_excel_pipeline),
+    "business-advisory": (ba_analysis_queue, ba_analysis_results, run_ba_pipeline),
+}
 
 
-def _generate_bar_chart_png(metrics: Dict[str, float], output_path: Path):
+CHART_WIDTH, CHART_HEIGHT = 400, 250
+
+def _make_bar_drawing(metrics: Dict[str, float]):
+    """Revenue / cost / net profit bar chart as vector shapes embedded directly in the report"""
+    from reportlab.graphics.shapes import Drawing, Line, Rect, String
+    from reportlab.lib import colors
+
     revenue = metrics.get("Total Revenue", 0.0)
     cost = metrics.get("Total Cost of Sales", 0.0)
     net_profit = metrics.get("Net Profit", 0.0)
@@ -356,106 +585,156 @@ def _generate_bar_chart_png(metrics: Dict[str, float], output_path: Path):
     values = [revenue, cost, net_profit]
     colors_list = ["#4CAF50", "#F44336", "#2196F3"]
 
-    plt.figure(figsize=(6, 4))
-    bars = plt.bar(labels, values, color=colors_list)
-    plt.title("Revenue vs Cost vs Net Profit")
-    plt.ylabel("Amount")
-    plt.grid(axis="y", linestyle="--", alpha=0.4)
-
-    # Add value labels on bars
-    for bar in bars:
-        height = bar.get_height()
-        plt.annotate(f"{height:,.0f}",
-                     xy=(bar.get_x() + bar.get_width() / 2, height),
-                     xytext=(0, 3),
-                     textcoords="offset points",
-                     ha="center", va="bottom", fontsize=8)
-
-    plt.tight_layout()
-    plt.savefig(output_path, dpi=150)
-    plt.close()
+    drawing = Drawing(CHART_WIDTH, CHART_HEIGHT)
+    drawing.add(String(CHART_WIDTH / 2, CHART_HEIGHT - 14, "Revenue vs Cost vs Net Profit",
+                       fontName="Helvetica", fontSize=11, textAnchor="middle"))
+
+    # Plot area between the category labels at the bottom and the title at the top;
+    # the zero line moves up when a value (e.g. a net loss) is negative
+    plot_bottom, plot_top = 34, CHART_HEIGHT - 40
+    low, high = min(0.0, *values), max(0.0, *values)
+    scale = (plot_top - plot_bottom) / ((high - low) or 1.0)
+    zero = plot_bottom - low * scale
+
+    slot = CHART_WIDTH / len(values)
+    bar_width = slot * 0.6
+    for i, (label, value, fill) in enumerate(zip(labels, values, colors_list)):
+        x = i * slot + (slot - bar_width) / 2
+        height = value * scale
+        drawing.add(Rect(x, min(zero, zero + height), bar_width, abs(height),
+                         fillColor=colors.HexColor(fill), strokeColor=None))
+        label_y = zero + height + 3 if value >= 0 else zero + height - 10
+        drawing.add(String(x + bar_width / 2, label_y, f"{value:,.0f}",
+                           fontName="Helvetica", fontSize=8, textAnchor="middle"))
+        drawing.add(String(x + bar_width / 2, 4, label,
+                           fontName="Helvetica", fontSize=9, textAnchor="middle"))
+
+    drawing.add(Line(0, zero, CHART_WIDTH, zero, strokeColor=colors.grey, strokeWidth=0.5))
+    return drawing
+
+
+@lru_cache(maxsize=1)
+def _report_styles():
+    """Paragraph styles and table style, built once; getSampleStyleSheet() is costly and never modified here"""
+    from reportlab.lib import colors
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.platypus import TableStyle
+
+    table_style = TableStyle([
+        ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
+        ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
+        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+        ('ALIGN', (1,1), (-1,-1), 'RIGHT'),
+    ])
+    styles = getSampleStyleSheet()
+    analysis_style = ParagraphStyle("Analysis", parent=styles['BodyText'], spaceAfter=6)
+    return styles, table_style, analysis_style
 
+def _build_pdf_report(result: AnalysisResult, report_file):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
 
-def _build_pdf_report(result: AnalysisResult, report_path: Path, chart_path: Optional[Path]):
-    doc = SimpleDocTemplate(str(report_path), pagesize=A4, rightMargin=36, leftMargin=36, topMargin=36, bottomMargin=36)
-    styles = getSampleStyleSheet()
-    elements = []
+    doc = SimpleDocTemplate(report_file, pagesize=A4, rightMargin=36, leftMargin=36, topMargin=36, bottomMargin=36)
+    styles, table_style, analysis_style = _report_styles()
 
     # Title
-    elements.append(Paragraph("Financial Analysis Report", styles['Title']))
-    elements.append(Spacer(1, 12))
     meta = f"Request ID: {result.request_id} | Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-    elements.append(Paragraph(meta, styles['Normal']))
-    elements.append(Spacer(1, 12))
+    elements = [
+        Paragraph("Financial Analysis Report", styles['Title']),
+        Spacer(1, 12),
+        Paragraph(meta, styles['Normal']),
+        Spacer(1, 12),
+    ]
 
     # Metrics table
-    elements.append(Paragraph("Extracted Metrics", styles['Heading2']))
-    metrics_data = [["Metric", "Value"]] + [[k, f"{v:,.2f}"] for k, v in result.metrics.items()]
-    metrics_table = Table(metrics_data, hAlign='LEFT')
-    metrics_table.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-        ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-        ('ALIGN', (1,1), (-1,-1), 'RIGHT'),
-    ]))
-    elements.append(metrics_table)
-    elements.append(Spacer(1, 12))
+    metrics_table = Table([["Metric", "Value"], *([k, f"{v:,.2f}"] for k, v in result.metrics.items())], hAlign='LEFT')
+    metrics_table.setStyle(table_style)
+    elements.extend([Paragraph("Extracted Metrics", styles['Heading2']), metrics_table, Spacer(1, 12)])
 
     # Ratios table
-    elements.append(Paragraph("Calculated Ratios", styles['Heading2']))
-    ratios_data = [["Ratio", "Value"]] + [[k, v] for k, v in result.ratios.items()]
-    ratios_table = Table(ratios_data, hAlign='LEFT')
-    ratios_table.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-        ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-        ('ALIGN', (1,1), (-1,-1), 'RIGHT'),
-    ]))
-    elements.append(ratios_table)
-    elements.append(Spacer(1, 12))
+    ratios_table = Table([["Ratio", "Value"], *([k, v] for k, v in result.ratios.items())], hAlign='LEFT')
+    ratios_table.setStyle(table_style)
+    elements.extend([Paragraph("Calculated Ratios", styles['Heading2']), ratios_table, Spacer(1, 12)])
 
     # Bar chart
-    if chart_path and chart_path.exists():
-        elements.append(Paragraph("Key Figures", styles['Heading2']))
-        elements.append(Image(str(chart_path), width=14*cm, height=9*cm))
-        elements.append(Spacer(1, 12))
+    elements.extend([Paragraph("Key Figures", styles['Heading2']), _make_bar_drawing(result.metrics), Spacer(1, 12)])
 
-    # AI analysis
+    # AI analysis, one Paragraph per block so page breaks fall between them;
+    # the style's spaceAfter replaces a Spacer after every paragraph
     elements.append(Paragraph("AI Analysis", styles['Heading2']))
     analysis_text = result.analysis or "No analysis available."
-    # Split into paragraphs for readability
-    for para in analysis_text.split("\n\n"):
-        elements.append(Paragraph(para.replace("\n", "<br/>"), styles['BodyText']))
-        elements.append(Spacer(1, 6))
+    elements.extend(Paragraph(para.replace("\n", "<br/>"), analysis_style) for para in analysis_text.split("\n\n"))
 
     doc.build(elements)
 
 
+def report_key(result: AnalysisResult) -> str:
+    """Short hash of everything that goes into a report"""
+    content = json.dumps([result.metrics, result.ratios, result.analysis], sort_keys=True)
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the client's If-None-Match already names this ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag in candidates or "*" in candidates
+
+
 @app.get("/report/{request_id}.pdf")
-async def download_report(request_id: str):
+async def download_report(request_id: str, request: Request):
     # Validate request
-    if request_id not in analysis_results:
+    stored = await analysis_results.aget(request_id)
+    if stored is None:
         raise HTTPException(status_code=404, detail="Analysis results not found")
 
-    result = analysis_results[request_id]
+    result = AnalysisResult(**stored)
     if result.status != "completed":
         raise HTTPException(status_code=400, detail="Analysis is not completed yet")
 
-    # Create chart
-    chart_filename = f"chart_{request_id}.png"
-    chart_path = Path("charts") / chart_filename
-    _generate_bar_chart_png(result.metrics, chart_path)
-
-    # Build PDF
+    # Results don't change once completed, so a report built for the same content is reused
+    key = report_key(result)
     report_filename = f"financial_report_{request_id}.pdf"
-    report_path = Path("reports") / report_filename
-    _build_pdf_report(result, report_path, chart_path)
+    report_path = Path("reports") / f"{request_id}_{key}.pdf"
+    etag = f'"{key}"'
+    headers = {
+        "Cache-Control": "public, max-age=60, stale-while-revalidate=600",
+        "ETag": etag
+    }
+
+    # The client already holds this exact report
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
 
-    # Stream file
-    return FileResponse(
-        path=str(report_path),
+    # One async stat answers both "is it cached?" and FileResponse's size/mtime needs
+    try:
+        stat_result = await aiofiles.os.stat(report_path)
+    except FileNotFoundError:
+        stat_result = None
+
+    if stat_result is not None:
+        # Stream file (Starlette sends it with sendfile and honours Range requests)
+        return FileResponse(
+            path=str(report_path),
+            media_type="application/pdf",
+            filename=report_filename,
+            stat_result=stat_result,
+            headers=headers
+        )
+
+    # First download: build in memory and answer from the buffer; the copy on disk
+    # only serves later downloads
+    buffer = io.BytesIO()
+    await asyncio.to_thread(_build_pdf_report, result, buffer)
+    pdf = buffer.getvalue()
+    await asyncio.to_thread(write_atomic, report_path, pdf)
+
+    return Response(
+        content=pdf,
         media_type="application/pdf",
-        filename=report_filename
+        headers={**headers, "Content-Disposition": f'attachment; filename="{report_filename}"'}
     )
 
 # API Endpoints
@@ -475,19 +754,18 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "api_key_configured": bool(os.getenv("GOO_API_KEY"))
+        "api_key_configured": GOOGLE_API_KEY_SET
     }
 
 @app.post("/analyze/upload", response_model=AnalysisResponse)
 async def analyze_upload(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(..., description="PDF file to analyze"),
     analysis_type: str = "full"
 ):
     """Upload and analyze a PDF file"""
     
     # Validate file type
-    if not file.filename.lower().endswith('.pdf'):
+    if not upload_extension(file) in PDF_EXTENSIONS:
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
     
     # Validate analysis type
@@ -495,92 +773,102 @@ async def analyze_upload(
         raise HTTPException(status_code=400, detail="Invalid analysis_type. Use 'metrics', 'ratios', or 'full'")
     
     # Check API key
-    if not os.getenv("GOOGLE_API_KEY") and analysis_type == "full":
+    if not GOOGLE_API_KEY_SET and analysis_type == "full":
         raise HTTPException(status_code=500, detail="Google API key not configured")
     
+    check_capacity()
+    
     try:
         # Generate request ID
-        request_id = str(uuid.uuid4())
+        request_id = new_request_id()
+        queued_at = datetime.now().isoformat()
         
         # Save uploaded file
-        file_path = save_uploaded_file(file)
+        file_path = await save_uploaded_file(file)
         
-        # Initialize queue entry
-        analysis_queue[request_id] = {
+        # Initialize queue entry and start background processing
+        await submit_job(analysis_queue, request_id, {
             "status": "queued",
             "file_path": file_path,
             "analysis_type": analysis_type,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        # Start background processing
-        background_tasks.add_task(process_analysis, request_id, file_path, analysis_type)
+            "timestamp": queued_at
+        }, process_analysis, file_path, analysis_type, uploads=(file_path,))
         
         return AnalysisResponse(
             request_id=request_id,
             status="queued",
             message="Analysis started successfully",
-            timestamp=datetime.now().isoformat()
+            timestamp=queued_at
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process upload: {str(e)}")
 
 @app.post("/analyze/spreadsheet/upload", response_model=AnalysisResponse)
 async def analyze_excel_upload(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(..., description="Excel file to analyze"),
     analysis_type: str = "full"
 ):
-    if not file.filename.lower().endswith(('.xlsx', '.xls', '.csv')):
+    if not upload_extension(file) in SPREADSHEET_EXTENSIONS:
         raise HTTPException(status_code=400, detail="Only Excel and CSV files are supported")
     
     if analysis_type not in ["metrics", "ratios", "full"]:
         raise HTTPException(status_code=400, detail="Invalid analysis_type")
     
+    check_capacity()
+    
     try:
-        request_id = str(uuid.uuid4())
-        file_path = save_uploaded_excel(file)
+        request_id = new_request_id()
+        queued_at = datetime.now().isoformat()
+        file_path = await save_uploaded_excel(file)
 
-        excel_analysis_queue[request_id] = {
+        await submit_job(excel_analysis_queue, request_id, {
             "status": "queued",
             "file_path": file_path,
             "analysis_type": analysis_type,
-            "timestamp": datetime.now().isoformat()
-        }
-
-        background_tasks.add_task(process_excel_analysis, request_id, file_path, analysis_type)
+            "timestamp": queued_at
+        }, process_excel_analysis, file_path, analysis_type, uploads=(file_path,))
 
         return AnalysisResponse(
             request_id=request_id,
             status="queued",
             message="Excel analysis started successfully",
-            timestamp=datetime.now().isoformat()
+            timestamp=queued_at
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process Excel upload: {str(e)}")
 
 @app.post("/analyze/business-advisory/upload", response_model=AnalysisResponse)
 async def analyze_ba_upload(
-    background_tasks: BackgroundTasks,
     finance_file: UploadFile = File(..., description="Excel file to analyze"),
     sales_file: UploadFile = File(..., description="PDF file to analyze"),
     analysis_type: str = "full"
 ):
-    if not finance_file.filename.lower().endswith('.pdf'):
+    if not upload_extension(finance_file) in PDF_EXTENSIONS:
         raise HTTPException(status_code=400, detail="Only PDF files are supported for Finance analysis")
     
-    if not sales_file.filename.lower().endswith(('.xlsx', '.xls', '.csv')):
+    if not upload_extension(sales_file) in SPREADSHEET_EXTENSIONS:
         raise HTTPException(status_code=400, detail="Only Excel and CSV files are supported for Sales analysis")
     
     if analysis_type not in ["metrics", "ratios", "full"]:
         raise HTTPException(status_code=400, detail="Invalid analysis_type")
     
+    check_capacity()
+    
     try:
-        request_id = str(uuid.uuid4())
-        file_path_sales = save_uploaded_excel(sales_file)
-        file_path_finance = save_uploaded_file(finance_file)
+        request_id = new_request_id()
+        queued_at = datetime.now().isoformat()
+        file_path_sales = await save_uploaded_excel(sales_file)
+        try:
+            file_path_finance = await save_uploaded_file(finance_file)
+        except Exception:
+            await cleanup_file(file_path_sales)
+            raise
 
         # ba_analysis_queue[request_id] = {
         #     "status": "queued",
@@ -590,28 +878,28 @@ async def analyze_ba_upload(
         #     "timestamp": datetime.now().isoformat()
         # }
 
-        ba_analysis_queue[request_id] = {
+        await submit_job(ba_analysis_queue, request_id, {
             "status": "queued",
             "file_path": file_path_sales,
             "analysis_type": analysis_type,
-            "timestamp": datetime.now().isoformat()
-        }
-
-        background_tasks.add_task(process_ba_analysis, request_id, file_path_finance, file_path_sales, analysis_type)
+            "timestamp": queued_at
+        }, process_ba_analysis, file_path_finance, file_path_sales, analysis_type,
+            uploads=(file_path_finance, file_path_sales))
 
         return AnalysisResponse(
             request_id=request_id,
             status="queued",
             message="Excel analysis started successfully",
-            timestamp=datetime.now().isoformat()
+            timestamp=queued_at
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process Excel upload: {str(e)}")
 
 @app.post("/analyze/file", response_model=AnalysisResponse)
 async def analyze_existing_file(
-    background_tasks: BackgroundTasks,
     request: AnalysisRequest
 ):
     """Analyze an existing PDF file"""
@@ -623,31 +911,31 @@ async def analyze_existing_file(
         raise HTTPException(status_code=404, detail="File not found")
     
     # Check API key
-    if not os.getenv("GOOGLE_API_KEY") and request.analysis_type == "full":
+    if not GOOGLE_API_KEY_SET and request.analysis_type == "full":
         raise HTTPException(status_code=500, detail="Google API key not configured")
     
     try:
         # Generate request ID
-        request_id = str(uuid.uuid4())
+        request_id = new_request_id()
+        queued_at = datetime.now().isoformat()
         
-        # Initialize queue entry
-        analysis_queue[request_id] = {
+        # Initialize queue entry and start background processing
+        await submit_job(analysis_queue, request_id, {
             "status": "queued",
             "file_path": request.file_path,
             "analysis_type": request.analysis_type,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        # Start background processing
-        background_tasks.add_task(process_analysis, request_id, request.file_path, request.analysis_type)
+            "timestamp": queued_at
+        }, process_analysis, request.file_path, request.analysis_type)
         
         return AnalysisResponse(
             request_id=request_id,
             status="queued",
             message="Analysis started successfully",
-            timestamp=datetime.now().isoformat()
+            timestamp=queued_at
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to start analysis: {str(e)}")
 
@@ -655,18 +943,17 @@ async def analyze_existing_file(
 async def get_analysis_status(request_id: str):
     """Get the status of an analysis request"""
     
-    if request_id not in analysis_queue:
+    queue_info = await analysis_queue.aget(request_id)
+    if queue_info is None:
         raise HTTPException(status_code=404, detail="Request ID not found")
     
-    queue_info = analysis_queue[request_id]
-    
     # Check if analysis is complete
-    if queue_info["status"] == "completed" and request_id in analysis_results:
-        result = analysis_results[request_id]
+    result = await analysis_results.aget(request_id) if queue_info["status"] == "completed" else None
+    if result is not None:
         return {
             "request_id": request_id,
             "status": "completed",
-            "result": result.dict(),
+            "result": result,
             "queue_info": queue_info
         }
     
@@ -680,26 +967,26 @@ async def get_analysis_status(request_id: str):
 async def get_analysis_results(request_id: str):
     """Get the completed analysis results"""
     
-    if request_id not in analysis_results:
+    result = await analysis_results.aget(request_id)
+    if result is None:
         raise HTTPException(status_code=404, detail="Analysis results not found")
     
-    result = analysis_results[request_id]
-    
-    if result.status == "failed":
-        raise HTTPException(status_code=500, detail=f"Analysis failed: {result.analysis}")
+    if result["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {result['analysis']}")
     
-    return result
+    # Stored results were built from AnalysisResult, so skip re-validating them
+    return json_response(result)
 
 @app.get("/status/spreadsheet/{request_id}")
 async def get_excel_status(request_id: str):
-    if request_id not in excel_analysis_queue:
+    queue_info = await excel_analysis_queue.aget(request_id)
+    if queue_info is None:
         raise HTTPException(status_code=404, detail="Request ID not found")
     
-    queue_info = excel_analysis_queue[request_id]
     # print('debugging queue_info:', queue_info)
 
-    if queue_info["status"] == "completed" and request_id in excel_analysis_results:
-        result = excel_analysis_results[request_id]
+    result = await excel_analysis_results.aget(request_id) if queue_info["status"] == "completed" else None
+    if result is not None:
         # print('Debugging app.get successful\n', f'Request_id {request_id}\nResult {result}\nQueue info: {queue_info}')
         return {
             "request_id": request_id, 
@@ -716,25 +1003,24 @@ async def get_excel_status(request_id: str):
 
 @app.get("/results/spreadsheet/{request_id}")
 async def get_excel_results(request_id: str):
-    if request_id not in excel_analysis_results:
+    result = await excel_analysis_results.aget(request_id)
+    if result is None:
         raise HTTPException(status_code=404, detail="Analysis results not found")
     
-    result = excel_analysis_results[request_id]
-    
     if result["status"] == "failed":
         raise HTTPException(status_code=500, detail=f"Analysis failed: {result['analysis']}")
-    return result
+    return json_response(result)
 
 @app.get("/status/business-advisory/{request_id}")
 async def get_ba_status(request_id: str):
-    if request_id not in ba_analysis_queue:
+    queue_info = await ba_analysis_queue.aget(request_id)
+    if queue_info is None:
         raise HTTPException(status_code=404, detail="Request ID not found")
     
-    queue_info = ba_analysis_queue[request_id]
     # print('debugging queue_info:', queue_info)
 
-    if queue_info["status"] == "completed" and request_id in ba_analysis_results:
-        result = ba_analysis_results[request_id]
+    result = await ba_analysis_results.aget(request_id) if queue_info["status"] == "completed" else None
+    if result is not None:
         
         return {
             "request_id": request_id, 
@@ -749,42 +1035,105 @@ async def get_ba_status(request_id: str):
         "queue_info": queue_info
     }
 
+# Seconds between store checks in a status stream, for status changes made by other workers
+STATUS_STREAM_POLL_SECONDS = 1.0
+# A comment line is sent after this long without an event, so proxies keep the connection open
+STATUS_STREAM_KEEPALIVE_SECONDS = 15.0
+
+async def stream_status(queue: Store, request_id: str):
+    """Server-sent events with the request's status, ending once it has completed or failed"""
+    status_subscribers[request_id] += 1
+    try:
+        last_status = None
+        idle = 0.0
+        while True:
+            queue_info = await queue.aget(request_id)
+            if queue_info is None:
+                # Cleaned up or expired while subscribed
+                return
+            status = queue_info["status"]
+            if status != last_status:
+                event = {"request_id": request_id, "status": status}
+                if "error" in queue_info:
+                    event["error"] = queue_info["error"]
+                yield b"data: " + orjson.dumps(event) + b"\n\n"
+                last_status = status
+                idle = 0.0
+            elif idle >= STATUS_STREAM_KEEPALIVE_SECONDS:
+                yield b": keep-alive\n\n"
+                idle = 0.0
+            if status in ("completed", "failed"):
+                return
+
+            waiter = status_waiters.setdefault(request_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(waiter.wait(), STATUS_STREAM_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                idle += STATUS_STREAM_POLL_SECONDS
+    finally:
+        status_subscribers[request_id] -= 1
+        if not status_subscribers[request_id]:
+            del status_subscribers[request_id]
+            status_waiters.pop(request_id, None)
+
+@app.get("/status/stream/{request_id}")
+async def stream_analysis_status(request_id: str, pipeline: str = "pdf"):
+    """Subscribe to status changes instead of polling /status (pipeline: pdf, spreadsheet or business-advisory)"""
+    if pipeline not in PIPELINES:
+        raise HTTPException(status_code=400, detail=f"Invalid pipeline. Use {', '.join(map(repr, PIPELINES))}")
+    queue = PIPELINES[pipeline][0]
+    if await queue.aget(request_id) is None:
+        raise HTTPException(status_code=404, detail="Request ID not found")
+    return StreamingResponse(
+        stream_status(queue, request_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
 @app.get("/results/business-advisory/{request_id}")
 async def get_ba_results(request_id: str):
-    if request_id not in ba_analysis_results:
+    result = await ba_analysis_results.aget(request_id)
+    if result is None:
         raise HTTPException(status_code=404, detail="Analysis results not found")
     
-    result = ba_analysis_results[request_id]
-    
     if result["status"] == "failed":
         raise HTTPException(status_code=500, detail=f"Analysis failed: {result['analysis']}")
-    return result
+    return json_response(result)
 
 @app.get("/queue", response_model=Dict[str, Any])
-async def get_queue_status():
-    """Get the current analysis queue status"""
-    return {
-        "total_requests": len(analysis_queue),
-        "completed": len([r for r in analysis_queue.values() if r["status"] == "completed"]),
-        "processing": len([r for r in analysis_queue.values() if r["status"] == "processing"]),
-        "queued": len([r for r in analysis_queue.values() if r["status"] == "queued"]),
-        "failed": len([r for r in analysis_queue.values() if r["status"] == "failed"]),
-        "requests": analysis_queue
-    }
+async def get_queue_status(limit: Optional[int] = None):
+    """Get the current analysis queue status
+
+    With ?limit=N only the N most recent requests are listed; the counts still cover all of them.
+    """
+    requests = await analysis_queue.aitems()
+    # One pass over the entries rather than one per status
+    status_counts = Counter(r["status"] for r in requests.values())
+    listed = requests
+    if limit is not None:
+        # Request ids are time-ordered, so the largest ids are the newest requests
+        listed = {request_id: requests[request_id] for request_id in heapq.nlargest(max(limit, 0), requests)}
+    return json_response({
+        "total_requests": len(requests),
+        "completed": status_counts["completed"],
+        "processing": status_counts["processing"],
+        "queued": status_counts["queued"],
+        "failed": status_counts["failed"],
+        "requests": listed
+    })
 
 @app.delete("/cleanup/{request_id}")
 async def cleanup_analysis(request_id: str):
     """Clean up analysis results and queue entry"""
     
-    if request_id in analysis_results:
-        del analysis_results[request_id]
+    await analysis_results.adelete(request_id)
     
-    if request_id in analysis_queue:
+    queue_info = await analysis_queue.aget(request_id)
+    if queue_info is not None:
         # Clean up temporary file if it exists
-        queue_info = analysis_queue[request_id]
         if "file_path" in queue_info:
-            cleanup_file(queue_info["file_path"])
-        del analysis_queue[request_id]
+            await cleanup_file(queue_info["file_path"])
+        await analysis_queue.adelete(request_id)
     
     return {"message": f"Cleaned up analysis {request_id}"}
 
@@ -792,14 +1141,15 @@ async def cleanup_analysis(request_id: str):
 async def cleanup_all():
     """Clean up all analysis results and queue entries"""
     
-    # Clean up all temporary files
-    for queue_info in analysis_queue.values():
-        if "file_path" in queue_info:
-            cleanup_file(queue_info["file_path"])
+    # Clean up all temporary files, removing them concurrently
+    await asyncio.gather(*(
+        cleanup_file(queue_info["file_path"])
+        for queue_info in (await analysis_queue.aitems()).values() if "file_path" in queue_info
+    ))
     
     # Clear all data
-    analysis_results.clear()
-    analysis_queue.clear()
+    await analysis_results.aclear()
+    await analysis_queue.aclear()
     
     return {"message": "Cleaned up all analyses"}
 
@@ -819,7 +1169,7 @@ if __name__ == "__main__":
     import uvicorn
     
     # Create uploads directory
-    Path("uploads").mkdir(exist_ok=True)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
     
     print("🚀 Starting Financial Statement Analysis API...")
     print("📚 API Documentation available at: http://localhost:8000/docs")
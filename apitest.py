@@ -0,0 +1,219 @@
+"""
+Shared HTTP plumbing for the test_api*.py clients
+
+One pooled session, the upload retry, the status stream/polling wait and the
+health, queue and cleanup checks are the same for every pipeline, so the
+client scripts import them from here.
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
+import mimetypes
+import time
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# API configuration
+API_BASE_URL = "http://localhost:8000"
+# Files (or pairs) tested at once; the API only runs a few analyses in parallel anyway
+MAX_PARALLEL_FILES = int(os.getenv("TEST_MAX_PARALLEL", "4"))
+
+# Progress is logged rather than printed so lines from concurrent test threads never interleave
+log = logging.getLogger("apitest")
+
+# Server answers worth retrying: a restarting worker or a full analysis queue
+RETRY_STATUSES = (502, 503, 504)
+# Statuses of an analysis that has not finished yet
+IN_FLIGHT_STATUSES = frozenset({'queued', 'processing'})
+# (connect, read) seconds; analysis results can take a while to come back
+REQUEST_TIMEOUT = (5, 120)
+
+# Status endpoint of each pipeline, by its /status/stream ?pipeline= name
+STATUS_PATHS = {
+    "pdf": "/status",
+    "spreadsheet": "/status/spreadsheet",
+    "business-advisory": "/status/business-advisory",
+}
+
+# All calls share one keep-alive connection pool instead of reconnecting per request,
+# sized so every test thread keeps its own connection warm
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=MAX_PARALLEL_FILES,
+                                     max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=RETRY_STATUSES)))
+
+try:
+    from requests_toolbelt.multipart.encoder import MultipartEncoder
+except ImportError:  # optional; without it requests builds the whole body in memory
+    MultipartEncoder = None
+
+def setup_logging():
+    """Log progress with a timestamp and the test thread's name (level from LOGLEVEL)"""
+    logging.basicConfig(level=os.getenv("LOGLEVEL", "INFO"), format="%(asctime)s %(threadName)s %(message)s")
+
+def post_files(url: str, files: dict, params: dict, attempts: int = 4):
+    """POST files as multipart/form-data, streamed from disk when requests-toolbelt is installed
+
+    The session only retries idempotent requests, so uploads answered with a
+    RETRY_STATUSES code are retried here with backoff; the open files are
+    rewound rather than reopened.
+    """
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(0.5 * 2 ** (attempt - 1))
+            for _, file, *_ in files.values():
+                file.seek(0)
+        if MultipartEncoder is None:
+            response = SESSION.post(url, files=files, params=params, timeout=REQUEST_TIMEOUT)
+        else:
+            encoder = MultipartEncoder(fields=files)
+            response = SESSION.post(url, data=encoder, headers={"Content-Type": encoder.content_type},
+                                    params=params, timeout=REQUEST_TIMEOUT)
+        if response.status_code not in RETRY_STATUSES:
+            break
+        log.warning("⚠️  Upload got %s, attempt %s/%s", response.status_code, attempt + 1, attempts)
+    return response
+
+def spreadsheet_mime_type(file_path: str) -> str:
+    """Content type for a sales file (.xlsx, .xls or .csv); "application/xlsx" isn't a real type"""
+    return mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+
+def test_health_check():
+    """Test the health check endpoint"""
+    log.info("🏥 Testing health check...")
+    try:
+        response = SESSION.get(f"{API_BASE_URL}/health", timeout=REQUEST_TIMEOUT)
+        if response.status_code == 200:
+            data = orjson.loads(response.content)
+            log.info("✅ Health check passed: %s", data)
+            return True
+        else:
+            log.error("❌ Health check failed: %s", response.status_code)
+            return False
+    except Exception as e:
+        log.error("❌ Health check error: %s", e)
+        return False
+
+def stream_status(request_id: str, pipeline: str, deadline: float):
+    """Follow the server-sent status events; None if the stream is unavailable, ends early or outlives deadline"""
+    try:
+        with SESSION.get(
+            f"{API_BASE_URL}/status/stream/{request_id}",
+            params={'pipeline': pipeline},
+            stream=True,
+            timeout=(3, max(deadline - time.monotonic(), 0.1))
+        ) as response:
+            if response.status_code != 200:
+                return None
+            for line in response.iter_lines():
+                # Keep-alive comments arrive every 15 seconds, so this bounds a quiet stream too
+                if time.monotonic() >= deadline:
+                    return None
+                if not line.startswith(b"data: "):
+                    continue
+                status = orjson.loads(line[len(b"data: "):])['status']
+                if status == 'completed':
+                    log.info("✅ Analysis completed!")
+                    return True
+                elif status == 'failed':
+                    log.error("❌ Analysis failed!")
+                    return False
+                log.info("⏳ Status: %s...", status)
+    except Exception as e:
+        log.warning("⚠️  Status stream error: %s", e)
+    return None
+
+def wait_for_completion(request_id: str, pipeline: str, max_wait_time: int = 300):
+    """Wait for analysis to complete"""
+    log.info("⏳ Waiting for analysis %s to complete...", request_id)
+
+    # One deadline covers both the stream and any polling after it
+    deadline = time.monotonic() + max_wait_time
+    # Subscribe to status changes; poll only if the server has no status stream
+    outcome = stream_status(request_id, pipeline, deadline)
+    if outcome is not None:
+        return outcome
+
+    # Poll quickly at first, then back off to every 5 seconds
+    interval = 0.25
+    last_status = None
+    while (remaining := deadline - time.monotonic()) > 0:
+        try:
+            response = SESSION.get(f"{API_BASE_URL}{STATUS_PATHS[pipeline]}/{request_id}",
+                                   timeout=(REQUEST_TIMEOUT[0], min(REQUEST_TIMEOUT[1], remaining)))
+            if response.status_code == 200:
+                data = orjson.loads(response.content)
+                status = data['status']
+
+                # Back to fast polling after a transition, e.g. once processing starts
+                if status != last_status:
+                    interval = 0.25
+                    last_status = status
+
+                if status == 'completed':
+                    log.info("✅ Analysis completed!")
+                    return True
+                elif status == 'failed':
+                    log.error("❌ Analysis failed!")
+                    return False
+                elif status in IN_FLIGHT_STATUSES:
+                    log.info("⏳ Status: %s...", status)
+                else:
+                    log.info("❓ Unknown status: %s", status)
+            else:
+                log.warning("⚠️  Status check failed: %s", response.status_code)
+
+        except Exception as e:
+            log.warning("⚠️  Status check error: %s", e)
+
+        time.sleep(max(min(interval, deadline - time.monotonic()), 0))
+        interval = min(interval * 1.5, 5.0)
+
+    log.warning("⏰ Timeout waiting for analysis to complete")
+    return False
+
+def test_queue_status():
+    """Test queue status endpoint"""
+    log.info("📋 Testing queue status...")
+
+    try:
+        response = SESSION.get(f"{API_BASE_URL}/queue", timeout=REQUEST_TIMEOUT)
+        if response.status_code == 200:
+            data = orjson.loads(response.content)
+            log.info("✅ Queue status: %s", data)
+            return True
+        else:
+            log.error("❌ Queue status failed: %s", response.status_code)
+            return False
+
+    except Exception as e:
+        log.error("❌ Queue status error: %s", e)
+        return False
+
+def cleanup_analysis(request_id: str):
+    """Clean up analysis"""
+    log.info("🧹 Cleaning up analysis %s...", request_id)
+
+    try:
+        response = SESSION.delete(f"{API_BASE_URL}/cleanup/{request_id}", timeout=REQUEST_TIMEOUT)
+        if response.status_code == 200:
+            data = orjson.loads(response.content)
+            log.info("✅ Cleanup successful: %s", data)
+            return True
+        else:
+            log.error("❌ Cleanup failed: %s", response.status_code)
+            return False
+
+    except Exception as e:
+        log.error("❌ Cleanup error: %s", e)
+        return False
+
+def check_health_and_queue() -> bool:
+    """Test health check and queue status; they are independent GETs, so run them side by side"""
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        queue_check = executor.submit(test_queue_status)
+        healthy = test_health_check()
+        queue_check.result()
+    return healthy
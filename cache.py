@@ -0,0 +1,62 @@
+"""
+On-disk cache helpers shared by the analysis pipelines
+"""
+
+import contextlib
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+
+# Root of the on-disk cache (extracted text, parsed spreadsheets, ...)
+CACHE_DIR = Path(os.getenv("ANALYSIS_CACHE_DIR", ".cache"))
+# Entries older than this are ignored and rebuilt
+CACHE_MAX_AGE_SECONDS = float(os.getenv("ANALYSIS_CACHE_MAX_AGE_DAYS", "7")) * 24 * 60 * 60
+
+def file_digest(file_path: str) -> str:
+    """Return the SHA-1 hex digest of a file's contents"""
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def schema_tag(*parts) -> str:
+    """Short hash of whatever shapes a cache entry (columns, dtypes, reader version, ...)
+
+    Putting it in the cache key means a change to any part gets new entries
+    instead of serving ones written by the old code.
+    """
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:12]
+
+def is_fresh(path: Path) -> bool:
+    """Whether a cache entry exists and is younger than CACHE_MAX_AGE_SECONDS"""
+    try:
+        return time.time() - path.stat().st_mtime < CACHE_MAX_AGE_SECONDS
+    except FileNotFoundError:
+        return False
+
+def cache_path(namespace: str, key: str, suffix: str) -> Path:
+    """Return the cache file for a key, creating its namespace directory"""
+    directory = CACHE_DIR / namespace
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / f"{key}{suffix}"
+
+def write_atomic(path: Path, data: bytes):
+    """Write data through a temporary file so readers never see a partial entry
+
+    The temporary file gets a unique name in the target directory, so threads
+    writing the same entry at once never rename each other's half-written file.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f"{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_name)
+        raise
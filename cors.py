@@ -0,0 +1,71 @@
+"""
+Allow-all CORS middleware for the API
+
+Behaves like Starlette's CORSMiddleware configured with allow_origins=["*"],
+allow_methods=["*"], allow_headers=["*"] and allow_credentials=True, but the
+response headers are built once at startup instead of being assembled in
+Python on every request.
+"""
+
+from typing import List, Tuple
+
+Headers = List[Tuple[bytes, bytes]]
+
+ALLOW_METHODS = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+PREFLIGHT_MAX_AGE = b"600"
+
+class FastCORS:
+    """Pure ASGI middleware adding fixed Access-Control-* headers to every response"""
+
+    def __init__(self, app):
+        self.app = app
+        self._simple_headers: Headers = [
+            (b"access-control-allow-origin", b"*"),
+            (b"access-control-allow-credentials", b"true"),
+        ]
+        self._preflight_headers: Headers = [
+            (b"access-control-allow-methods", ALLOW_METHODS),
+            (b"access-control-allow-credentials", b"true"),
+            (b"access-control-max-age", PREFLIGHT_MAX_AGE),
+            (b"vary", b"Origin"),
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", b"2"),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = dict(scope["headers"])
+        origin = request_headers.get(b"origin")
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] == "OPTIONS" and b"access-control-request-method" in request_headers:
+            await self._preflight(origin, request_headers, send)
+            return
+
+        # Browsers reject "*" on credentialed requests, so echo the origin when cookies are sent
+        if b"cookie" in request_headers:
+            extra = [(b"access-control-allow-origin", origin),
+                     (b"access-control-allow-credentials", b"true"),
+                     (b"vary", b"Origin")]
+        else:
+            extra = self._simple_headers
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), *extra]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+    async def _preflight(self, origin: bytes, request_headers: dict, send):
+        headers = [(b"access-control-allow-origin", origin), *self._preflight_headers]
+        requested = request_headers.get(b"access-control-request-headers")
+        if requested:
+            headers.append((b"access-control-allow-headers", requested))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": b"OK"})
@@ -0,0 +1,160 @@
+"""
+Shared Gemini client used by the analysis pipelines
+"""
+
+import asyncio
+import hashlib
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Optional
+from dotenv import load_dotenv
+from langchain_google_genai import ChatGoogleGenerativeAI
+from cache import cache_path, is_fresh, write_atomic
+
+# Every entry point imports this module before reading GOOGLE_API_KEY, so .env is loaded here once
+load_dotenv()
+
+GEMINI_MODEL = "gemini-2.0-flash"
+
+# Upper bound on Gemini requests in flight at once from this process, to stay under the rate limit
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "4"))
+
+@lru_cache(maxsize=1)
+def get_llm() -> ChatGoogleGenerativeAI:
+    """Return the process-wide Gemini client, built on first use so its HTTP session is reused"""
+    return ChatGoogleGenerativeAI(model=GEMINI_MODEL, api_key=os.getenv("GOOGLE_API_KEY"))
+
+# --- Exact prompt cache ---
+# Replies are stored on disk under the SHA-256 of model + prompt, so re-running
+# an analysis on the same data skips the Gemini round trip entirely
+def _reply_path(prompt: str) -> Path:
+    key = hashlib.sha256(f"{GEMINI_MODEL}\n{prompt}".encode("utf-8")).hexdigest()
+    return cache_path("gemini", key, ".txt")
+
+def cached_reply(prompt: str) -> Optional[str]:
+    """Return the stored reply for an identical prompt, if any"""
+    path = _reply_path(prompt)
+    return path.read_text(encoding="utf-8") if is_fresh(path) else None
+
+def store_reply(prompt: str, reply: str):
+    """Remember a reply; empty replies are not cached"""
+    if reply:
+        write_atomic(_reply_path(prompt), reply.encode("utf-8"))
+
+def complete(prompt: str) -> str:
+    """Return Gemini's reply to a prompt"""
+    reply = cached_reply(prompt)
+    if reply is not None:
+        print("✅ Reusing cached Gemini reply")
+        return reply
+
+    reply = get_llm().invoke(prompt).content
+
+    store_reply(prompt, reply)
+    return reply
+
+# --- Analysis steps ---
+# The pipelines' analyze steps differ only in the state key they fill, what counts as
+# something to analyze and how the prompt is built, so they share these two helpers
+def _analysis_prompt(state: dict, key: str, build_prompt: Callable[[dict], str],
+                     has_data: Callable[[dict], bool], no_data: str) -> Optional[str]:
+    """The prompt to send, or None with the reason recorded in state[key]"""
+    if not os.getenv("GOOGLE_API_KEY"):
+        print("❌ Cannot analyze: GOOGLE_API_KEY not found")
+        state[key] = "Analysis failed: API key not available"
+        return None
+
+    if not has_data(state):
+        print("⚠️  Nothing available for analysis")
+        state[key] = f"Analysis failed: {no_data}"
+        return None
+
+    print("🤖 Requesting AI analysis from Gemini...")
+    return build_prompt(state)
+
+def _analysis_failed(state: dict, key: str, e: Exception):
+    print(f"❌ Error during AI analysis: {e}")
+    state[key] = f"Analysis failed: {str(e)}"
+
+def analyze(state: dict, key: str, build_prompt: Callable[[dict], str], has_data: Callable[[dict], bool],
+            no_data: str = "No financial data available") -> dict:
+    """Store Gemini's reply to build_prompt(state) in state[key]
+
+    A missing API key, nothing to analyze (has_data false) or a failed call is
+    recorded in state[key] as "Analysis failed: ..." instead of raising.
+    """
+    try:
+        prompt = _analysis_prompt(state, key, build_prompt, has_data, no_data)
+        if prompt is not None:
+            state[key] = complete(prompt)
+            print("✅ AI analysis completed successfully")
+    except Exception as e:
+        _analysis_failed(state, key, e)
+    return state
+
+_request_slots: Optional[asyncio.Semaphore] = None
+
+def _slots() -> asyncio.Semaphore:
+    # Created on first use so it belongs to the running event loop
+    global _request_slots
+    if _request_slots is None:
+        _request_slots = asyncio.Semaphore(GEMINI_CONCURRENCY)
+    return _request_slots
+
+async def acomplete(prompt: str) -> str:
+    """Async variant of complete(), bounded to GEMINI_CONCURRENCY concurrent calls"""
+    reply = cached_reply(prompt)
+    if reply is not None:
+        print("✅ Reusing cached Gemini reply")
+        return reply
+
+    async with _slots():
+        reply = (await get_llm().ainvoke(prompt)).content
+
+    store_reply(prompt, reply)
+    return reply
+
+async def aanalyze(state: dict, key: str, build_prompt: Callable[[dict], str], has_data: Callable[[dict], bool],
+                   no_data: str = "No financial data available") -> dict:
+    """analyze() for async callers, so the Gemini call does not hold a thread"""
+    try:
+        prompt = _analysis_prompt(state, key, build_prompt, has_data, no_data)
+        if prompt is not None:
+            state[key] = await acomplete(prompt)
+            print("✅ AI analysis completed successfully")
+    except Exception as e:
+        _analysis_failed(state, key, e)
+    return state
+
+def complete_batch(prompts: list) -> list:
+    """Reply to several prompts, sending the uncached ones in a single batched call
+
+    A prompt that fails gets its exception in place of a reply.
+    """
+    replies = [cached_reply(prompt) for prompt in prompts]
+    misses = [index for index, reply in enumerate(replies) if reply is None]
+    if misses:
+        results = get_llm().batch([prompts[index] for index in misses], return_exceptions=True)
+        for index, result in zip(misses, results):
+            if isinstance(result, Exception):
+                replies[index] = result
+            else:
+                store_reply(prompts[index], result.content)
+                replies[index] = result.content
+    return replies
+
+async def acomplete_batch(prompts: list) -> list:
+    """Async variant of complete_batch(); the batch takes one GEMINI_CONCURRENCY slot"""
+    replies = [cached_reply(prompt) for prompt in prompts]
+    misses = [index for index, reply in enumerate(replies) if reply is None]
+    if misses:
+        async with _slots():
+            results = await get_llm().abatch([prompts[index] for index in misses], return_exceptions=True)
+        for index, result in zip(misses, results):
+            if isinstance(result, Exception):
+                replies[index] = result
+            else:
+                store_reply(prompts[index], result.content)
+                replies[index] = result.content
+    return replies
@@ -1,7 +1,4 @@
-from dotenv import load_dotenv
-load_dotenv()
-
-from langchain.chat_models import init_chat_model
+from gemini import get_llm  # loads .env
 from typing import Annotated
 from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
@@ -10,18 +7,20 @@ from langchain_core.tools import tool
 from langgraph.prebuilt import ToolNode, tools_condition
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.types import interrupt, Command
-import os
 import random
 from datetime import datetime
+from types import MappingProxyType
 
 class State(TypedDict):
     messages: Annotated[list, add_messages]
 
+STOCK_PRICES = MappingProxyType({"MSFT": 200.3, "AAPL": 100.4, "AMZN": 150.0, "RIL": 87.6})
+
 @tool
 def get_stock_price(symbol: str) -> float:
     #your API call to get stock price
     '''Return the current price of a stock given the stock symbol'''
-    return {"MSFT": 200.3, "AAPL": 100.4, "AMZN": 150.0, "RIL": 87.6}.get(symbol, 0.0)
+    return STOCK_PRICES.get(symbol, 0.0)
 
 @tool
 def buy_stocks(symbol: str, quantity: int, total_price: float) -> str:
@@ -37,9 +36,8 @@ def buy_stocks(symbol: str, quantity: int, total_price: float) -> str:
 
 
 tools = [get_stock_price, buy_stocks]
-key = os.getenv("GOOGLE_API_KEY")
 
-llm = init_chat_model("google_genai:gemini-2.0-flash",api_key=key)
+llm = get_llm()
 llm_with_tools = llm.bind_tools(tools)
 
 def chatbot_node(state: State):
@@ -57,16 +55,19 @@ builder.add_edge("chatbot", END)
 graph = builder.compile(checkpointer=memory)
 
 config = {"configurable": {"thread_id": "buy_thread"}}
+# Checkpoint once when a run finishes or is interrupted instead of after every step;
+# the thread state is only read back at the start of the next turn
+DURABILITY = "exit"
 
 # Step 1: user asks price
-state = graph.invoke({"messages":[{"role":"user","content":"What is the current price of 7 RIL stocks?"}]}, config=config)
+state = graph.invoke({"messages":[{"role":"user","content":"What is the current price of 7 RIL stocks?"}]}, config=config, durability=DURABILITY)
 print(state["messages"][-1].content)
 
 # Step 2: user asks to buy
-state = graph.invoke({"messages":[{"role":"user","content":"Buy 7 RIL stocks at current price."}]}, config=config)
+state = graph.invoke({"messages":[{"role":"user","content":"Buy 7 RIL stocks at current price."}]}, config=config, durability=DURABILITY)
 print(state.get("__interrupt__"))
 
 decision = input("Approve (yes/no): ")
-state = graph.invoke(Command(resume=decision), config=config)
+state = graph.invoke(Command(resume=decision), config=config, durability=DURABILITY)
 print(state["messages"][-1].content)
 
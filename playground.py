@@ -1,7 +1,4 @@
-from dotenv import load_dotenv
-load_dotenv()
-
-from langchain.chat_models import init_chat_model
+from gemini import get_llm  # loads .env
 from typing import Annotated
 from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
@@ -10,11 +7,52 @@ from langchain_core.tools import tool
 from langgraph.prebuilt import ToolNode, tools_condition
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.types import interrupt, Command
-import os
+import asyncio
+import logging
 import random
+import threading
+import time
 from datetime import datetime
+from types import MappingProxyType
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
+
+# Tool diagnostics go through logging rather than print so they stay out of the streamed replies
+log = logging.getLogger(__name__)
+
+# One keep-alive session for the cash data API, so repeated tool calls skip the TCP/TLS handshake
+_SESSION = requests.Session()
+_SESSION.headers["Accept"] = "application/json"
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=Retry(total=2, backoff_factor=0.2)))
+
+CASH_DATA_URL = "https://asbk.mitcloud.com/v6-beta/v6IntegrationAPIlogin/getCashData"
+# Balances are reused for this long, so asking again within a conversation skips the HTTP call
+CASH_DATA_TTL_SECONDS = 30
+_cash_data_cache = {}
+_cash_data_lock = threading.Lock()
+
+def _get_cash_data(prompt: str) -> dict:
+    """POST a cash data query; non-empty replies are cached for CASH_DATA_TTL_SECONDS"""
+    now = time.monotonic()
+    with _cash_data_lock:
+        cached = _cash_data_cache.get(prompt)
+    if cached is not None and now - cached[0] < CASH_DATA_TTL_SECONDS:
+        return cached[1]
+
+    response = _SESSION.post(CASH_DATA_URL, json={"domain": "demo6", "prompt": prompt}, timeout=(3, 15))
+    response.raise_for_status()
+    response_json = orjson.loads(response.content)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("API Response: %r", response_json)
+
+    # Empty replies are not cached, so a transient API problem isn't pinned for the whole TTL
+    if response_json:
+        with _cash_data_lock:
+            _cash_data_cache[prompt] = (now, response_json)
+    return response_json
 
 class State(TypedDict):
     messages: Annotated[list, add_messages]
@@ -23,81 +61,57 @@ class State(TypedDict):
 def get_payable() -> str:
     '''Return the payable amount from the API'''
     
-    url = "https://asbk.mitcloud.com/v6-beta/v6IntegrationAPIlogin/getCashData"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
-    data = {
-        "domain": "demo6",
-        "prompt": "payable"
-    }
-
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=15)
-        response.raise_for_status()
-        response_json = response.json()
-        print("API Response:", response_json)
+        response_json = _get_cash_data("payable")
 
         cash_str = response_json.get("AP amount")
         if not cash_str:
-            print("Warning: 'payable' field not found.")
+            log.warning("'payable' field not found.")
             return 'AP amount 0.0'
 
         return cash_str
         
     except RequestException as e:
-        print(f"RequestException: {e}")
+        log.error("RequestException: %s", e)
         if hasattr(e, 'response') and e.response is not None:
-            print(f"Status Code: {e.response.status_code}")
-            print(f"Response Text: {e.response.text}")
+            log.error("Status Code: %s", e.response.status_code)
+            log.error("Response Text: %s", e.response.text)
         return 0.0
     except Exception as e:
-        print(f"Unexpected Error: {e}")
+        log.error("Unexpected Error: %s", e)
         return 0.0
     
 @tool
 def get_cashbalance() -> str:
     '''Return the cash balance from the API'''
     
-    url = "https://asbk.mitcloud.com/v6-beta/v6IntegrationAPIlogin/getCashData"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
-    data = {
-        "domain": "demo6",
-        "prompt": "cash"
-    }
-
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=15)
-        response.raise_for_status()
-        response_json = response.json()
-        print("API Response:", response_json)
+        response_json = _get_cash_data("cash")
 
         cash_str = response_json.get("Cash balance")
         if not cash_str:
-            print("Warning: 'cash Balance' field not found.")
+            log.warning("'cash Balance' field not found.")
             return 'cash balance 0.0'
 
         return cash_str
         
     except RequestException as e:
-        print(f"RequestException: {e}")
+        log.error("RequestException: %s", e)
         if hasattr(e, 'response') and e.response is not None:
-            print(f"Status Code: {e.response.status_code}")
-            print(f"Response Text: {e.response.text}")
+            log.error("Status Code: %s", e.response.status_code)
+            log.error("Response Text: %s", e.response.text)
         return 0.0
     except Exception as e:
-        print(f"Unexpected Error: {e}")
+        log.error("Unexpected Error: %s", e)
         return 0.0
     
+STOCK_PRICES = MappingProxyType({"MSFT": 200.3, "AAPL": 100.4, "AMZN": 150.0, "RIL": 87.6})
+
 @tool
 def get_stock_price(symbol: str) -> float:
     #your API call to get stock price
     '''Return the current price of a stock given the stock symbol'''
-    return {"MSFT": 200.3, "AAPL": 100.4, "AMZN": 150.0, "RIL": 87.6}.get(symbol, 0.0)
+    return STOCK_PRICES.get(symbol, 0.0)
 
 @tool
 def buy_stocks(symbol: str, quantity: int, total_price: float) -> str:
@@ -113,13 +127,19 @@ def buy_stocks(symbol: str, quantity: int, total_price: float) -> str:
 
 
 tools = [get_stock_price, buy_stocks, get_cashbalance, get_payable]
-key = os.getenv("GOOGLE_API_KEY")
 
-llm = init_chat_model("google_genai:gemini-2.0-flash",api_key=key)
+llm = get_llm()
 llm_with_tools = llm.bind_tools(tools)
 
-def chatbot_node(state: State):
-    msg = llm_with_tools.invoke(state["messages"])
+# ToolNode runs the tool calls of one model reply concurrently, so
+# asking for both balances in a single reply overlaps the two HTTP round trips
+SYSTEM_PROMPT = (
+    "When an answer needs both the cash balance and the payable amount, "
+    "call get_cashbalance and get_payable together in the same response."
+)
+
+async def chatbot_node(state: State):
+    msg = await llm_with_tools.ainvoke([("system", SYSTEM_PROMPT), *state["messages"]])
     return {"messages": [msg]}
 
 memory = MemorySaver()
@@ -133,24 +153,31 @@ builder.add_edge("chatbot", END)
 graph = builder.compile(checkpointer=memory)
 
 config = {"configurable": {"thread_id": "buy_thread"}}
-
-
-state = None
-while True:
-    in_message = input("You: ")
-    if in_message.lower() in {"quit","exit"}:
-        break
-    if state is None:
-        state: State = {
-            "messages": [{"role": "user", "content": in_message}]
-        }
-    else:
-        state["messages"].append({"role": "user", "content": in_message})
-
-    state = graph.invoke(state, config=config)
-    print("Bot:", state["messages"][-1].content)
-    
-    '''who are you?
+# Checkpoint once when a run finishes or is interrupted instead of after every step;
+# the thread state is only read back at the start of the next turn
+DURABILITY = "exit"
+
+
+async def chat():
+    while True:
+        in_message = await asyncio.to_thread(input, "You: ")
+        if in_message.lower() in {"quit","exit"}:
+            break
+
+        # The checkpointer holds the conversation, so a turn only sends the new message;
+        # the reply is printed token by token as Gemini streams it
+        print("Bot: ", end="", flush=True)
+        async for event in graph.astream_events(
+            {"messages": [{"role": "user", "content": in_message}]},
+            config=config, version="v2", durability=DURABILITY
+        ):
+            if event["event"] == "on_chat_model_stream":
+                content = event["data"]["chunk"].content
+                if isinstance(content, str):
+                    print(content, end="", flush=True)
+        print()
+
+        '''who are you?
 Bot: I am Gemini, a large language model built by Google.
 You: what can you do
 Bot: I can provide information, generate text, and translate languages. I can also access and use specific tools to help with tasks, such as retrieving stock prices or making stock trades.
@@ -166,4 +193,6 @@ You: Who walked on the moon for the first time? Print only the name
 Bot: Neil Armstrong
 You: what year
 Bot: 1969
-'''
\ No newline at end of file
+'''
+
+asyncio.run(chat())
@@ -7,17 +7,26 @@ import os
 import uvicorn
 from pathlib import Path
 
-# Create uploads directory
-Path("uploads").mkdir(exist_ok=True)
+# Create uploads directory (api.py reads UPLOAD_DIR too)
+Path(os.getenv("UPLOAD_DIR", "uploads")).mkdir(parents=True, exist_ok=True)
 
 # Get port from environment (DigitalOcean sets this)
 port = int(os.getenv("PORT", 8000))
 
+# Each worker is its own process, so they only see each other's requests through a
+# shared store; with the default in-memory store a status poll could land on a worker
+# that never saw the upload, so default to one worker there
+shared_store = os.getenv("ANALYSIS_STORE", "memory") in ("sqlite", "redis")
+workers = int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 2) if shared_store else 1))
+# api.py divides the CPUs between the workers using this, so pass the final count on
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
 # Production settings
 if __name__ == "__main__":
     print(f"🚀 Starting Financial Statement Analysis API on port {port}...")
     print(f"🌍 Environment: {os.getenv('ENVIRONMENT', 'production')}")
     print(f"🔑 API Key configured: {bool(os.getenv('GOOGLE_API_KEY'))}")
+    print(f"👷 Workers: {workers}")
     
     uvicorn.run(
         "api:app",
@@ -25,6 +34,7 @@ if __name__ == "__main__":
         port=port,
         reload=False,  # Disable reload in production
         log_level="info",
-        access_log=True,
-        workers=1  # Single worker for App Platform
+        # Per-request access lines cost more than most handlers here; opt back in with ACCESS_LOG=true
+        access_log=os.getenv("ACCESS_LOG", "false").lower() == "true",
+        workers=workers
     )
@@ -0,0 +1,279 @@
+"""
+Key-value storage for analysis requests and results
+
+The API keeps its queue entries and results in a Store instead of plain module
+dicts, so they can live in process memory (the default), in SQLite, which
+several uvicorn workers on one host can share and which survives a restart,
+or in Redis, which API processes on any number of hosts can share.
+
+Async code calls the a*-prefixed methods: SQLite may wait up to 30 seconds on
+another worker's write lock, so that store runs each call in a worker thread
+instead of on the event loop, and the Redis store uses the redis.asyncio client.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, Optional
+
+try:
+    import redis
+    import redis.asyncio as aioredis
+except ImportError:  # only needed for ANALYSIS_STORE=redis
+    redis = aioredis = None
+
+# Backend used by make_store(): "memory", "sqlite" or "redis"
+STORE_BACKEND = os.getenv("ANALYSIS_STORE", "memory")
+STORE_PATH = os.getenv("ANALYSIS_STORE_PATH", "analysis.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Entries kept per in-memory namespace before the least recently used one is dropped
+STORE_MAX_ENTRIES = int(os.getenv("ANALYSIS_STORE_MAX_ENTRIES", "1024"))
+
+class Store(ABC):
+    """Minimal mapping of request id -> JSON-serializable dict"""
+
+    # Whether calls can block on I/O; the async methods then run them in a thread
+    blocking = True
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None):
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+    @abstractmethod
+    def items(self) -> Dict[str, Dict[str, Any]]:
+        ...
+
+    def values(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.items().values())
+
+    def update(self, key: str, ttl: Optional[float] = None, **fields):
+        """Merge fields into an existing entry (a nested dict edit would not persist)"""
+        value = self.get(key)
+        if value is not None:
+            value.update(fields)
+            self.set(key, value, ttl=ttl)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.values())
+
+    async def _call(self, method: Callable, *args, **kwargs):
+        if not self.blocking:
+            return method(*args, **kwargs)
+        return await asyncio.to_thread(method, *args, **kwargs)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        return await self._call(self.get, key)
+
+    async def aset(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None):
+        await self._call(self.set, key, value, ttl=ttl)
+
+    async def aupdate(self, key: str, ttl: Optional[float] = None, **fields):
+        await self._call(self.update, key, ttl=ttl, **fields)
+
+    async def adelete(self, key: str):
+        await self._call(self.delete, key)
+
+    async def aclear(self):
+        await self._call(self.clear)
+
+    async def aitems(self) -> Dict[str, Dict[str, Any]]:
+        return await self._call(self.items)
+
+class MemoryStore(Store):
+    """Process-local LRU store; entries are lost on restart and not shared between workers
+
+    At most maxsize entries are kept. Reading or writing an entry marks it as
+    recently used; on overflow the least recently used one is dropped and
+    passed to on_evict, as are entries found expired. Nothing here blocks, so async callers skip the thread hop.
+    """
+
+    blocking = False
+
+    def __init__(self, maxsize: int = STORE_MAX_ENTRIES, on_evict: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._maxsize = maxsize
+        self._on_evict = on_evict
+
+    def _live(self, key: str) -> Optional[tuple]:
+        entry = self._data.get(key)
+        if entry is not None and entry[0] is not None and entry[0] <= time.time():
+            del self._data[key]
+            if self._on_evict is not None:
+                self._on_evict(entry[1])
+            return None
+        return entry
+
+    def get(self, key):
+        entry = self._live(key)
+        if entry is None:
+            return None
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self._maxsize:
+            _, (_, evicted) = self._data.popitem(last=False)
+            if self._on_evict is not None:
+                self._on_evict(evicted)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def items(self):
+        return {key: entry[1] for key in list(self._data) if (entry := self._live(key)) is not None}
+
+class SQLiteStore(Store):
+    """Store backed by one SQLite table per namespace, shareable between worker processes"""
+
+    def __init__(self, path: str, namespace: str):
+        self._table = f"store_{namespace}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._table} "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get(self, key):
+        rows = self._execute(
+            f"SELECT value FROM {self._table} WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        self._execute(
+            f"INSERT OR REPLACE INTO {self._table} (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, default=str), expires_at)
+        )
+
+    def delete(self, key):
+        self._execute(f"DELETE FROM {self._table} WHERE key = ?", (key,))
+
+    def clear(self):
+        self._execute(f"DELETE FROM {self._table}")
+
+    def items(self):
+        # Expired rows are dropped here rather than by a separate sweeper
+        self._execute(f"DELETE FROM {self._table} WHERE expires_at <= ?", (time.time(),))
+        return {key: json.loads(value) for key, value in self._execute(f"SELECT key, value FROM {self._table}")}
+
+class RedisStore(Store):
+    """Store backed by Redis string keys under a per-namespace prefix; Redis expires them itself
+
+    The async methods go through a redis.asyncio client, so a status poll waits
+    on the round trip without holding the event loop or a worker thread.
+    """
+
+    def __init__(self, url: str, namespace: str):
+        if redis is None:
+            raise RuntimeError("ANALYSIS_STORE=redis requires the redis package (pip install redis)")
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._aclient = aioredis.Redis.from_url(url, decode_responses=True)
+        self._prefix = f"analysis:{namespace}:"
+
+    def _keys(self) -> list:
+        return list(self._client.scan_iter(match=f"{self._prefix}*", count=1000))
+
+    async def _akeys(self) -> list:
+        return [key async for key in self._aclient.scan_iter(match=f"{self._prefix}*", count=1000)]
+
+    def _decode_items(self, keys: list, values: list) -> Dict[str, Dict[str, Any]]:
+        # Keys can expire between SCAN and MGET; those come back as None
+        start = len(self._prefix)
+        return {key[start:]: json.loads(value) for key, value in zip(keys, values) if value is not None}
+
+    def get(self, key):
+        value = self._client.get(self._prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        px = int(ttl * 1000) if ttl else None
+        self._client.set(self._prefix + key, json.dumps(value, default=str), px=px)
+
+    def delete(self, key):
+        self._client.delete(self._prefix + key)
+
+    def clear(self):
+        keys = self._keys()
+        if keys:
+            self._client.delete(*keys)
+
+    def items(self):
+        keys = self._keys()
+        if not keys:
+            return {}
+        return self._decode_items(keys, self._client.mget(keys))
+
+    async def aget(self, key):
+        value = await self._aclient.get(self._prefix + key)
+        return json.loads(value) if value is not None else None
+
+    async def aset(self, key, value, ttl=None):
+        px = int(ttl * 1000) if ttl else None
+        await self._aclient.set(self._prefix + key, json.dumps(value, default=str), px=px)
+
+    async def aupdate(self, key, ttl=None, **fields):
+        value = await self.aget(key)
+        if value is not None:
+            value.update(fields)
+            await self.aset(key, value, ttl=ttl)
+
+    async def adelete(self, key):
+        await self._aclient.delete(self._prefix + key)
+
+    async def aclear(self):
+        keys = await self._akeys()
+        if keys:
+            await self._aclient.delete(*keys)
+
+    async def aitems(self):
+        keys = await self._akeys()
+        if not keys:
+            return {}
+        return self._decode_items(keys, await self._aclient.mget(keys))
+
+def make_store(namespace: str, on_evict: Optional[Callable[[Dict[str, Any]], None]] = None) -> Store:
+    """Create the configured store for a namespace (e.g. "pdf_results")
+
+    on_evict is called with entries the in-memory store drops, when full or
+    once their TTL has passed; the SQLite and Redis stores expire entries
+    without it.
+    """
+    if STORE_BACKEND == "sqlite":
+        return SQLiteStore(STORE_PATH, namespace)
+    if STORE_BACKEND == "redis":
+        return RedisStore(REDIS_URL, namespace)
+    return MemoryStore(on_evict=on_evict)
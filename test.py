@@ -3,9 +3,9 @@ import os
 
 load_dotenv()  # loads GOOGLE_API_KEY into environment
 #print("CWD =", os.getcwd())
-key = os.getenv("GOO_API_KEY")
+_API_KEY = os.environ["GOOGLE_API_KEY"]
 from langchain_google_genai import ChatGoogleGenerativeAI
 
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", api_key=key)
+llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", api_key=_API_KEY)
 print(llm.invoke("Hello Gemini"))
-#print("GOOGLE_API_KEY =", os.getenv("GOO_API_KEY"))
\ No newline at end of file
+#print("GOOGLE_API_KEY =", os.getenv("GOOGLE_API_KEY"))
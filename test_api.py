@@ -3,67 +3,51 @@
 Test client for the Financial Statement Analysis API
 """
 
-import requests
-import json
-import time
+import orjson
 import os
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# API configuration
-API_BASE_URL = "http://localhost:8000"
-
-def test_health_check():
-    """Test the health check endpoint"""
-    print("🏥 Testing health check...")
-    try:
-        response = requests.get(f"{API_BASE_URL}/health")
-        if response.status_code == 200:
-            data = response.json()
-            print(f"✅ Health check passed: {data}")
-            return True
-        else:
-            print(f"❌ Health check failed: {response.status_code}")
-            return False
-    except Exception as e:
-        print(f"❌ Health check error: {e}")
-        return False
+from apitest import (
+    API_BASE_URL, MAX_PARALLEL_FILES, REQUEST_TIMEOUT, SESSION, log, setup_logging, post_files,
+    check_health_and_queue, wait_for_completion, cleanup_analysis, test_queue_status,
+)
 
 def test_upload_analysis(pdf_file_path: str):
     """Test file upload and analysis"""
-    print(f"\n📤 Testing file upload analysis for: {pdf_file_path}")
+    log.info("📤 Testing file upload analysis for: %s", pdf_file_path)
     
     if not os.path.exists(pdf_file_path):
-        print(f"❌ File not found: {pdf_file_path}")
+        log.error("❌ File not found: %s", pdf_file_path)
         return None
     
     try:
         # Upload file
         with open(pdf_file_path, 'rb') as f:
             files = {'file': (os.path.basename(pdf_file_path), f, 'application/pdf')}
-            response = requests.post(
+            response = post_files(
                 f"{API_BASE_URL}/analyze/upload",
                 files=files,
                 params={'analysis_type': 'full'}
             )
         
         if response.status_code == 200:
-            data = response.json()
-            print(f"✅ Upload successful: {data}")
+            data = orjson.loads(response.content)
+            log.info("✅ Upload successful: %s", data)
             return data['request_id']
         else:
-            print(f"❌ Upload failed: {response.status_code} - {response.text}")
+            log.error("❌ Upload failed: %s - %s", response.status_code, response.text)
             return None
             
     except Exception as e:
-        print(f"❌ Upload error: {e}")
+        log.error("❌ Upload error: %s", e)
         return None
 
 def test_file_analysis(pdf_file_path: str):
     """Test analysis of existing file"""
-    print(f"\n📁 Testing existing file analysis for: {pdf_file_path}")
+    log.info("📁 Testing existing file analysis for: %s", pdf_file_path)
     
     if not os.path.exists(pdf_file_path):
-        print(f"❌ File not found: {pdf_file_path}")
+        log.error("❌ File not found: %s", pdf_file_path)
         return None
     
     try:
@@ -72,163 +56,99 @@ def test_file_analysis(pdf_file_path: str):
             "analysis_type": "full"
         }
         
-        response = requests.post(
+        response = SESSION.post(
             f"{API_BASE_URL}/analyze/file",
-            json=payload
+            json=payload,
+            timeout=REQUEST_TIMEOUT
         )
         
         if response.status_code == 200:
-            data = response.json()
-            print(f"✅ File analysis started: {data}")
+            data = orjson.loads(response.content)
+            log.info("✅ File analysis started: %s", data)
             return data['request_id']
         else:
-            print(f"❌ File analysis failed: {response.status_code} - {response.text}")
+            log.error("❌ File analysis failed: %s - %s", response.status_code, response.text)
             return None
             
     except Exception as e:
-        print(f"❌ File analysis error: {e}")
+        log.error("❌ File analysis error: %s", e)
         return None
 
-def wait_for_completion(request_id: str, max_wait_time: int = 300):
-    """Wait for analysis to complete"""
-    print(f"\n⏳ Waiting for analysis {request_id} to complete...")
-    
-    start_time = time.time()
-    while time.time() - start_time < max_wait_time:
-        try:
-            response = requests.get(f"{API_BASE_URL}/status/{request_id}")
-            if response.status_code == 200:
-                data = response.json()
-                status = data['status']
-                
-                if status == 'completed':
-                    print(f"✅ Analysis completed!")
-                    return True
-                elif status == 'failed':
-                    print(f"❌ Analysis failed!")
-                    return False
-                elif status in ['queued', 'processing']:
-                    print(f"⏳ Status: {status}...")
-                else:
-                    print(f"❓ Unknown status: {status}")
-            else:
-                print(f"⚠️  Status check failed: {response.status_code}")
-                
-        except Exception as e:
-            print(f"⚠️  Status check error: {e}")
-        
-        time.sleep(5)  # Wait 5 seconds before checking again
-    
-    print(f"⏰ Timeout waiting for analysis to complete")
-    return False
-
 def get_results(request_id: str):
     """Get analysis results"""
-    print(f"\n📊 Getting results for {request_id}...")
+    log.info("📊 Getting results for %s...", request_id)
     
     try:
-        response = requests.get(f"{API_BASE_URL}/results/{request_id}")
+        response = SESSION.get(f"{API_BASE_URL}/results/{request_id}", timeout=REQUEST_TIMEOUT)
         if response.status_code == 200:
-            data = response.json()
-            print("✅ Results retrieved successfully!")
-            print(f"📈 Metrics: {data['metrics']}")
-            print(f"📊 Ratios: {data['ratios']}")
-            print(f"🤖 Analysis: {data['analysis'][:200]}...")
-            print(f"⏱️  Processing time: {data['processing_time']:.2f} seconds")
+            data = orjson.loads(response.content)
+            log.info("✅ Results retrieved successfully!")
+            log.info("📈 Metrics: %s", data['metrics'])
+            log.info("📊 Ratios: %s", data['ratios'])
+            log.info("🤖 Analysis: %s...", data['analysis'][:200])
+            log.info("⏱️  Processing time: %.2f seconds", data['processing_time'])
             return data
         else:
-            print(f"❌ Failed to get results: {response.status_code} - {response.text}")
+            log.error("❌ Failed to get results: %s - %s", response.status_code, response.text)
             return None
             
     except Exception as e:
-        print(f"❌ Results retrieval error: {e}")
+        log.error("❌ Results retrieval error: %s", e)
         return None
 
-def test_queue_status():
-    """Test queue status endpoint"""
-    print("\n📋 Testing queue status...")
+def run_one_file(file_path: str) -> bool:
+    """Upload one file, wait for its analysis, fetch the results and clean up"""
+    request_id = test_upload_analysis(file_path)
     
-    try:
-        response = requests.get(f"{API_BASE_URL}/queue")
-        if response.status_code == 200:
-            data = response.json()
-            print(f"✅ Queue status: {data}")
-            return True
-        else:
-            print(f"❌ Queue status failed: {response.status_code}")
-            return False
+    if request_id:
+        # Wait for completion
+        if wait_for_completion(request_id, "pdf"):
+            # Get results
+            results = get_results(request_id)
             
-    except Exception as e:
-        print(f"❌ Queue status error: {e}")
-        return False
-
-def cleanup_analysis(request_id: str):
-    """Clean up analysis"""
-    print(f"\n🧹 Cleaning up analysis {request_id}...")
-    
-    try:
-        response = requests.delete(f"{API_BASE_URL}/cleanup/{request_id}")
-        if response.status_code == 200:
-            data = response.json()
-            print(f"✅ Cleanup successful: {data}")
-            return True
+            if results:
+                log.info("🎉 Test completed successfully for %s!", file_path)
+                
+                # Clean up
+                cleanup_analysis(request_id)
+                return True
+            else:
+                log.error("❌ Failed to retrieve results for %s", file_path)
         else:
-            print(f"❌ Cleanup failed: {response.status_code}")
-            return False
-            
-    except Exception as e:
-        print(f"❌ Cleanup error: {e}")
-        return False
+            log.error("❌ Analysis of %s did not complete in time", file_path)
+    else:
+        log.error("❌ Failed to start analysis of %s", file_path)
+    return False
 
 def main():
     """Main test function"""
-    print("🚀 Financial Statement Analysis API Test Client")
-    print("=" * 50)
+    setup_logging()
+    log.info("🚀 Financial Statement Analysis API Test Client")
+    log.info("=" * 50)
     
-    # Test health check
-    if not test_health_check():
-        print("❌ API is not running. Please start the API server first.")
+    if not check_health_and_queue():
+        log.error("❌ API is not running. Please start the API server first.")
         return
     
-    # Test queue status
-    test_queue_status()
-    
     # Look for PDF files in current directory
-    pdf_files = list(Path(".").glob("*.pdf"))
+    with os.scandir(".") as entries:
+        pdf_files = [entry.name for entry in entries if entry.name.endswith(".pdf") and entry.is_file()]
     
     if not pdf_files:
-        print("\n⚠️  No PDF files found in current directory")
-        print("Please place a PDF file in the current directory to test with")
+        log.warning("⚠️  No PDF files found in current directory")
+        log.info("Please place a PDF file in the current directory to test with")
         return
     
-    print(f"\n📄 Found {len(pdf_files)} PDF file(s):")
+    log.info("📄 Found %s PDF file(s):", len(pdf_files))
     for pdf_file in pdf_files:
-        print(f"   - {pdf_file}")
-    
-    # Test with first PDF file
-    test_pdf = str(pdf_files[0])
-    print(f"\n🎯 Testing with: {test_pdf}")
-    
-    # Test file upload analysis
-    request_id = test_upload_analysis(test_pdf)
-    
-    if request_id:
-        # Wait for completion
-        if wait_for_completion(request_id):
-            # Get results
-            results = get_results(request_id)
-            
-            if results:
-                print("\n🎉 Test completed successfully!")
-                
-                # Clean up
-                cleanup_analysis(request_id)
-            else:
-                print("\n❌ Failed to retrieve results")
-        else:
-            print("\n❌ Analysis did not complete in time")
-    else:
-        print("\n❌ Failed to start analysis")
+        log.info("   - %s", pdf_file)
+    
+    # Test every file at once; each runs upload -> wait -> results -> cleanup on its own thread
+    log.info("🎯 Testing %s file(s), up to %s at a time", len(pdf_files), MAX_PARALLEL_FILES)
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_FILES, len(pdf_files))) as executor:
+        futures = [executor.submit(run_one_file, pdf_file) for pdf_file in pdf_files]
+        passed = sum(future.result() for future in as_completed(futures))
+    log.info("📊 %s/%s file(s) passed", passed, len(pdf_files))
     
     # Test queue status again
     test_queue_status()
@@ -3,37 +3,21 @@
 Test client for the Business and Financial Advisory Analysis API
 """
 
-import requests
-import json
-import time
+import orjson
 import os
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# API configuration
-API_BASE_URL = "http://localhost:8000"
-
-def test_health_check():
-    """Test the health check endpoint"""
-    print("🏥 Testing health check...")
-    try:
-        response = requests.get(f"{API_BASE_URL}/health")
-        if response.status_code == 200:
-            data = response.json()
-            print(f"✅ Health check passed: {data}")
-            return True
-        else:
-            print(f"❌ Health check failed: {response.status_code}")
-            return False
-    except Exception as e:
-        print(f"❌ Health check error: {e}")
-        return False
+from apitest import (
+    API_BASE_URL, MAX_PARALLEL_FILES, REQUEST_TIMEOUT, SESSION, log, setup_logging, post_files,
+    spreadsheet_mime_type, check_health_and_queue, wait_for_completion, cleanup_analysis, test_queue_status,
+)
 
 def test_upload_analysis(sales_file_path: str, finance_file_path: str):
     """Test file upload and analysis"""
-    print(f"\n📤 Testing file upload analysis for: {sales_file_path} and {finance_file_path}")
+    log.info("📤 Testing file upload analysis for: %s and %s", sales_file_path, finance_file_path)
     
     if not os.path.exists(sales_file_path) or not os.path.exists(finance_file_path):
-        print(f"❌ File not found: {sales_file_path} or {finance_file_path}")
+        log.error("❌ File not found: %s or %s", sales_file_path, finance_file_path)
         return None
     
     try:
@@ -41,176 +25,115 @@ def test_upload_analysis(sales_file_path: str, finance_file_path: str):
         with open(sales_file_path, 'rb') as f_sales, open(finance_file_path, 'rb') as f_finance:
             files = {
                 'finance_file': (os.path.basename(finance_file_path), f_finance, 'application/pdf'),
-                'sales_file': (os.path.basename(sales_file_path), f_sales, 'application/xlsx'),
+                'sales_file': (os.path.basename(sales_file_path), f_sales, spreadsheet_mime_type(sales_file_path)),
             }
 
-            response = requests.post(
+            response = post_files(
                 f"{API_BASE_URL}/analyze/business-advisory/upload",
                 files=files,
                 params={'analysis_type': 'full'}
             )
         
         if response.status_code == 200:
-            data = response.json()
-            print(f"✅ Upload successful: {data}")
+            data = orjson.loads(response.content)
+            log.info("✅ Upload successful: %s", data)
             return data['request_id']
         else:
-            print(f"❌ Upload failed: {response.status_code} - {response.text}")
+            log.error("❌ Upload failed: %s - %s", response.status_code, response.text)
             return None
             
     except Exception as e:
-        print(f"❌ Upload error: {e}")
+        log.error("❌ Upload error: %s", e)
         return None
 
-def wait_for_completion(request_id: str, max_wait_time: int = 300):
-    """Wait for analysis to complete"""
-    print(f"\n⏳ Waiting for analysis {request_id} to complete...")
-    
-    start_time = time.time()
-    while time.time() - start_time < max_wait_time:
-        try:
-            response = requests.get(f"{API_BASE_URL}/status/business-advisory/{request_id}")
-            # response = requests.get(f"{API_BASE_URL}/status/spreadsheet/{request_id}")
-            
-            if response.status_code == 200:
-                data = response.json()
-                status = data['status']
-                
-                if status == 'completed':
-                    print(f"✅ Analysis completed!")
-                    return True
-                elif status == 'failed':
-                    print(f"❌ Analysis failed!")
-                    return False
-                elif status in ['queued', 'processing']:
-                    print(f"⏳ Status: {status}...")
-                else:
-                    print(f"❓ Unknown status: {status}")
-            else:
-                print(f"⚠️  Status check failed: {response.status_code}")
-                
-        except Exception as e:
-            print(f"⚠️  Status check error: {e}")
-        
-        time.sleep(5)  # Wait 5 seconds before checking again
-    
-    print(f"⏰ Timeout waiting for analysis to complete")
-    return False
-
 def get_results(request_id: str):
     """Get analysis results"""
-    print(f"\n📊 Getting results for {request_id}...")
+    log.info("📊 Getting results for %s...", request_id)
     
     try:
-        response = requests.get(f"{API_BASE_URL}/results/business-advisory/{request_id}")
+        response = SESSION.get(f"{API_BASE_URL}/results/business-advisory/{request_id}", timeout=REQUEST_TIMEOUT)
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
 
-            print("✅ Results retrieved successfully!")
+            log.info("✅ Results retrieved successfully!")
             # print(f"📈 Metrics: {data['metrics']}")
             # print(f"📊 Ratios: {data['ratios']}")
-            print(f"💰 Finance Analysis: {data['analysis_finance'][:200]}...")
-            print(f"\n💼 Sales Analysis: {data['analysis_sales'][:200]}...")
-            print(f"\n🤖 Business Advisory Analysis: {data['analysis']}...")
-            print(f"⏱️  Processing time: {data['processing_time']:.2f} seconds")
+            log.info("💰 Finance Analysis: %s...", data['analysis_finance'][:200])
+            log.info("💼 Sales Analysis: %s...", data['analysis_sales'][:200])
+            log.info("🤖 Business Advisory Analysis: %s...", data['analysis'])
+            log.info("⏱️  Processing time: %.2f seconds", data['processing_time'])
             return data
         else:
-            print(f"❌ Failed to get results: {response.status_code} - {response.text}")
+            log.error("❌ Failed to get results: %s - %s", response.status_code, response.text)
             return None
             
     except Exception as e:
-        print(f"❌ Results retrieval error: {e}")
+        log.error("❌ Results retrieval error: %s", e)
         return None
 
-def test_queue_status():
-    """Test queue status endpoint"""
-    print("\n📋 Testing queue status...")
+def run_one_pair(sales_file_path: str, finance_file_path: str) -> bool:
+    """Upload one sales/finance pair, wait for its analysis, fetch the results and clean up"""
+    request_id = test_upload_analysis(sales_file_path, finance_file_path)
     
-    try:
-        response = requests.get(f"{API_BASE_URL}/queue")
-        if response.status_code == 200:
-            data = response.json()
-            print(f"✅ Queue status: {data}")
-            return True
-        else:
-            print(f"❌ Queue status failed: {response.status_code}")
-            return False
+    if request_id:
+        # Wait for completion
+        if wait_for_completion(request_id, "business-advisory"):
+            # Get results
+            results = get_results(request_id)
             
-    except Exception as e:
-        print(f"❌ Queue status error: {e}")
-        return False
-
-def cleanup_analysis(request_id: str):
-    """Clean up analysis"""
-    print(f"\n🧹 Cleaning up analysis {request_id}...")
-    
-    try:
-        response = requests.delete(f"{API_BASE_URL}/cleanup/{request_id}")
-        if response.status_code == 200:
-            data = response.json()
-            print(f"✅ Cleanup successful: {data}")
-            return True
+            if results:
+                log.info("🎉 Test completed successfully for %s and %s!", sales_file_path, finance_file_path)
+                
+                # Clean up
+                cleanup_analysis(request_id)
+                return True
+            else:
+                log.error("❌ Failed to retrieve results for %s and %s", sales_file_path, finance_file_path)
         else:
-            print(f"❌ Cleanup failed: {response.status_code}")
-            return False
-            
-    except Exception as e:
-        print(f"❌ Cleanup error: {e}")
-        return False
+            log.error("❌ Analysis of %s and %s did not complete in time", sales_file_path, finance_file_path)
+    else:
+        log.error("❌ Failed to start analysis of %s and %s", sales_file_path, finance_file_path)
+    return False
 
 def main():
     """Main test function"""
-    print("🚀 Business Advisory Analysis (Combination) API Test Client")
-    print("=" * 50)
+    setup_logging()
+    log.info("🚀 Business Advisory Analysis (Combination) API Test Client")
+    log.info("=" * 50)
     
-    # Test health check
-    if not test_health_check():
-        print("❌ API is not running. Please start the API server first.")
+    if not check_health_and_queue():
+        log.error("❌ API is not running. Please start the API server first.")
         return
     
-    # Test queue status
-    test_queue_status()
-    
     # Look for excel files in current directory
-    excel_files = [f for f in Path(".").iterdir() if f.suffix in [".xlsx", ".xls"]]
-    pdf_files = [f for f in Path(".").iterdir() if f.suffix == ".pdf"]
+    # One pass over the directory sorts entries into both lists
+    excel_files, pdf_files = [], []
+    with os.scandir(".") as entries:
+        for entry in entries:
+            suffix = os.path.splitext(entry.name)[1].lower()
+            if suffix in (".xlsx", ".xls") and entry.is_file():
+                excel_files.append(entry.name)
+            elif suffix == ".pdf" and entry.is_file():
+                pdf_files.append(entry.name)
 
-    if not excel_files and not pdf_files:
-        print("\n⚠️  No excel or pdf files found in current directory")
-        print("Please place an excel or pdf file in the current directory to test with")
+    if not excel_files or not pdf_files:
+        log.warning("⚠️  Need at least one excel and one pdf file in current directory")
+        log.info("Please place an excel and a pdf file in the current directory to test with")
         return
 
-    print(f"\n📄 Found {len(excel_files)} Excel file(s) and {len(pdf_files)} PDF file(s):")
+    log.info("📄 Found %s Excel file(s) and %s PDF file(s):", len(excel_files), len(pdf_files))
     for excel_file in excel_files:
-        print(f"   - {excel_file}")
+        log.info("   - %s", excel_file)
     for pdf_file in pdf_files:
-        print(f"   - {pdf_file}")
-    
-    # Test with first Excel and Pdf files
-    test_excel = str(excel_files[0])
-    test_pdf = str(pdf_files[0])
-    print(f"\n🎯 Testing with: {test_excel} and {test_pdf}")
-    
-    # Test file upload analysis
-    request_id = test_upload_analysis(test_excel, test_pdf)
+        log.info("   - %s", pdf_file)
     
-    if request_id:
-        # Wait for completion
-        if wait_for_completion(request_id):
-            # Get results
-            results = get_results(request_id)
-            
-            if results:
-                print("\n🎉 Test completed successfully!")
-                
-                # Clean up
-                cleanup_analysis(request_id)
-            else:
-                print("\n❌ Failed to retrieve results")
-        else:
-            print("\n❌ Analysis did not complete in time")
-    else:
-        print("\n❌ Failed to start analysis")
+    # Pair the files up and test the pairs at once; each runs upload -> wait -> results -> cleanup on its own thread
+    pairs = list(zip(excel_files, pdf_files))
+    log.info("🎯 Testing %s Excel/PDF pair(s), up to %s at a time", len(pairs), MAX_PARALLEL_FILES)
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_FILES, len(pairs))) as executor:
+        futures = [executor.submit(run_one_pair, excel_file, pdf_file) for excel_file, pdf_file in pairs]
+        passed = sum(future.result() for future in as_completed(futures))
+    log.info("📊 %s/%s pair(s) passed", passed, len(pairs))
     
     # Test queue status again
     test_queue_status()
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Check that the sample sales files give real months in Monthly Sales
+
+Runs the read and ratio steps of analyse_ba.py only, so no API server or
+Gemini key is needed: python test_sales_dates.py (or pytest test_sales_dates.py)
+"""
+
+import analyse_ba
+
+SAMPLE_FILES = ("data.xls", "data.xlsx", "data_csv.csv")
+
+def monthly_sales(file_path: str) -> dict:
+    state = analyse_ba.read_statement({"file_path": file_path})
+    return analyse_ba.calculate_ratios(state)["ratios"].get("Monthly Sales", {})
+
+def test_sample_files_give_real_months():
+    for file_path in SAMPLE_FILES:
+        months = monthly_sales(file_path)
+        assert months, f"{file_path}: no Monthly Sales"
+        # Numeric yyyymmdd dates read as epoch nanoseconds all land in 1970-01
+        assert all(month >= "2000-01" for month in months), f"{file_path}: {sorted(months)}"
+
+if __name__ == "__main__":
+    test_sample_files_give_real_months()
+    print(f"✅ Monthly Sales use real months for {', '.join(SAMPLE_FILES)}")